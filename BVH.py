@@ -0,0 +1,216 @@
+import math
+
+class BVHNode:
+    def __init__(self, lo, hi, parent=None):
+        self.lo = lo            # (x, y, z) of the minimum corner
+        self.hi = hi            # (x, y, z) of the maximum corner
+        self.parent = parent
+        self.left = None
+        self.right = None
+        self.objects = None     # Only leaves hold objects
+
+class BVH:
+    """
+    Bounding volume hierarchy over the world-space bounding boxes of a scene's objects.
+
+    The tree is built once and then kept up to date frame by frame with update():
+    objects whose transform changed since the last update only have their leaf
+    and its ancestors refit, so the per-frame cost is proportional to what moved.
+    Refitting slowly degrades the tree, so it is rebuilt from scratch when its
+    surface area cost grows past rebuild_threshold times the cost right after the last build.
+    Unbounded objects (planes) have no box, so they are kept out of the tree and tested for every ray.
+    """
+
+    PAD = 1e-7    # Node boxes are padded slightly so round off never culls a real hit
+
+    def __init__(self, leaf_size=2, rebuild_threshold=1.5):
+        self.leaf_size = leaf_size
+        self.rebuild_threshold = rebuild_threshold
+        self.root = None
+        self.objects = []
+        self.unbounded = []         # Objects without world bounds, always tested
+        self.leaf_of = {}           # object -> leaf holding it
+        self.fitted_versions = {}   # object -> GeomObj.version its bounds were taken from
+        self.build_cost = 0
+        self.area_sum = 0           # Sum of node areas weighted as in cost(), kept up to date by refit
+        self.last_update = "not built"
+
+    """
+    Bring the tree up to date with the (already frozen) objects.
+    Rebuilds if the list of objects changed, otherwise refits the ones that moved.
+    """
+    def update(self, objects):
+        if self.root is None or objects != self.objects:
+            self.build(objects)
+            return
+        moved = [obj for obj in objects if obj.version != self.fitted_versions[obj]]
+        if any((obj.world_min is None) != (obj in self.unbounded) for obj in moved):
+            self.build(objects)     # An object gained or lost its bounds
+            return
+        if len(moved) == 0:
+            self.last_update = "unchanged"
+            return
+        self.refit(moved)
+        cost = self.cost()
+        if cost > self.rebuild_threshold * self.build_cost:
+            self.build(objects)
+            self.last_update = "rebuilt, refit cost was {0:.2f}x the last build".format(cost / self.build_cost)
+        else:
+            self.last_update = "refit {0} moved object(s), cost {1:.2f}x the last build".format(len(moved), cost / self.build_cost)
+
+    def build(self, objects):
+        self.objects = list(objects)
+        self.leaf_of = {}
+        self.fitted_versions = {obj: obj.version for obj in objects}
+        self.unbounded = [obj for obj in objects if obj.world_min is None]
+        bounded = [obj for obj in objects if obj.world_min is not None]
+        self.root = self.build_node(bounded, None) if len(bounded) > 0 else None
+        self.area_sum = self.weighted_area()
+        self.build_cost = self.cost()
+        self.last_update = "built over {0} objects".format(len(bounded))
+        if len(self.unbounded) > 0:
+            self.last_update += " plus {0} unbounded".format(len(self.unbounded))
+
+    def build_node(self, objects, parent):
+        (lo, hi) = BVH.bounds_of(objects)
+        node = BVHNode(lo, hi, parent)
+        if len(objects) <= self.leaf_size:
+            node.objects = objects
+            for obj in objects:
+                self.leaf_of[obj] = node
+            return node
+
+        # Split at the median centroid along the axis where the centroids are most spread out
+        centroids = {obj: tuple((obj.world_min[i] + obj.world_max[i]) / 2 for i in range(3)) for obj in objects}
+        spread = [max(c[i] for c in centroids.values()) - min(c[i] for c in centroids.values()) for i in range(3)]
+        axis = spread.index(max(spread))
+        ordered = sorted(objects, key=lambda obj: centroids[obj][axis])
+        half = len(ordered) // 2
+        node.left = self.build_node(ordered[:half], node)
+        node.right = self.build_node(ordered[half:], node)
+        return node
+
+    """
+    Refit the leaves holding the moved objects and every ancestor up to the root.
+    Each walk stops early once a node's box no longer changes.
+    area_sum is adjusted for every box that changes, so the cost check after a refit does not walk the whole tree.
+    """
+    def refit(self, moved):
+        for obj in moved:
+            self.fitted_versions[obj] = obj.version
+            if obj in self.unbounded:
+                continue
+            node = self.leaf_of[obj]
+            old_area = BVH.area(node.lo, node.hi)
+            (node.lo, node.hi) = BVH.bounds_of(node.objects)
+            self.area_sum += (BVH.area(node.lo, node.hi) - old_area) * len(node.objects)
+            node = node.parent
+            while node is not None:
+                lo = tuple(min(node.left.lo[i], node.right.lo[i]) for i in range(3))
+                hi = tuple(max(node.left.hi[i], node.right.hi[i]) for i in range(3))
+                if lo == node.lo and hi == node.hi:
+                    break
+                self.area_sum += BVH.area(lo, hi) - BVH.area(node.lo, node.hi)
+                (node.lo, node.hi) = (lo, hi)
+                node = node.parent
+
+    """
+    Surface area heuristic cost of the tree: the expected number of box and object tests
+    for a random ray hitting the root (relative area = probability of hitting a node).
+    """
+    def cost(self):
+        if self.root is None:
+            return 0
+        root_area = BVH.area(self.root.lo, self.root.hi)
+        if root_area <= 0:
+            return 1
+        return self.area_sum / root_area
+
+    # Area of every node, leaves weighted by their number of objects (the sum kept in area_sum)
+    def weighted_area(self):
+        if self.root is None:
+            return 0
+        total = 0
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.objects is not None:
+                total += BVH.area(node.lo, node.hi) * len(node.objects)
+            else:
+                total += BVH.area(node.lo, node.hi)
+                stack.append(node.left)
+                stack.append(node.right)
+        return total
+
+    """
+    Same contract as Scene.intersect: updates best_hit with the closest hit,
+    or returns True the moment any hit is found when just_one is set.
+    """
+    def intersect(self, ray, best_hit, skip_translucent=False, just_one=False, ignore=()):
+        for obj in self.unbounded:
+            if obj not in ignore and (not skip_translucent or not obj.material.is_translucent()):
+                if obj.intersect(ray, best_hit) and just_one:
+                    return True
+        if self.root is None:
+            return False
+        s = ray.source
+        d = ray.dir
+        (sx, sy, sz) = (s.x, s.y, s.z)
+        inv = (1 / d.dx if d.dx != 0 else math.inf, 1 / d.dy if d.dy != 0 else math.inf, 1 / d.dz if d.dz != 0 else math.inf)
+        (ix, iy, iz) = inv
+
+        # Children are ordered along the axis the ray moves fastest in
+        moves = (abs(d.dx), abs(d.dy), abs(d.dz))
+        axis = moves.index(max(moves))
+        backwards = (d.dx, d.dy, d.dz)[axis] < 0
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            t_max = best_hit.t if best_hit.t != -1 else math.inf
+            if not BVH.hits_box(sx, sy, sz, ix, iy, iz, node.lo, node.hi, t_max):
+                continue
+            if node.objects is not None:
+                for obj in node.objects:
+                    if obj not in ignore and (not skip_translucent or not obj.material.is_translucent()):
+                        if obj.intersect(ray, best_hit) and just_one:
+                            return True
+            else:
+                # Push the far child first so the near one is visited (and shrinks best_hit.t) first
+                (near, far) = (node.left, node.right)
+                if (near.lo[axis] + near.hi[axis] > far.lo[axis] + far.hi[axis]) != backwards:
+                    (near, far) = (far, near)
+                stack.append(far)
+                stack.append(near)
+        return False
+
+    @staticmethod
+    def hits_box(sx, sy, sz, ix, iy, iz, lo, hi, t_max):
+        # Slab test, a ray parallel to a slab only passes if it starts between its planes
+        t_enter = 0
+        t_exit = t_max
+        for (p, i, l, h) in ((sx, ix, lo[0], hi[0]), (sy, iy, lo[1], hi[1]), (sz, iz, lo[2], hi[2])):
+            if i == math.inf:
+                if p < l or p > h:
+                    return False
+                continue
+            t0 = (l - p) * i
+            t1 = (h - p) * i
+            if t0 > t1:
+                (t0, t1) = (t1, t0)
+            if t0 > t_enter: t_enter = t0
+            if t1 < t_exit: t_exit = t1
+            if t_enter > t_exit:
+                return False
+        return True
+
+    @staticmethod
+    def bounds_of(objects):
+        lo = tuple(min(obj.world_min[i] for obj in objects) - BVH.PAD for i in range(3))
+        hi = tuple(max(obj.world_max[i] for obj in objects) + BVH.PAD for i in range(3))
+        return (lo, hi)
+
+    @staticmethod
+    def area(lo, hi):
+        (dx, dy, dz) = (hi[0] - lo[0], hi[1] - lo[1], hi[2] - lo[2])
+        return 2 * (dx * dy + dy * dz + dz * dx)
@@ -0,0 +1,102 @@
+import queue
+import threading
+import traceback
+
+class RenderJob:
+    """
+    Handle for a ray trace queued on (or running on) a BackgroundRenderer.
+
+    The job's render function reports its progress through update(), which returns False once
+    the job has been cancelled, so it can be used directly as Scene.progress.
+    While a frame renders, pixmap is the RGBPixmap being filled (for showing it as it fills in).
+    """
+
+    def __init__(self, name, frames=1):
+        self.name = name
+        self.frames = frames
+        self.frame = 0          # Frame being rendered
+        self.fraction = 0.0     # ... and how much of it is done
+        self.pixmap = None
+        self.outputs = []       # Files written so far
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def done(self):
+        return self.done_event.is_set()
+
+    def update(self, fraction, frame=None):
+        if frame is not None:
+            self.frame = frame
+        self.fraction = fraction
+        return not self.cancelled()
+
+    # Fraction of the whole job done
+    def progress(self):
+        return min(1.0, (self.frame + self.fraction) / self.frames)
+
+class BackgroundRenderer:
+    """
+    Runs ray tracing jobs one after another on a background thread, so the interactive loop
+    (and its OpenGL preview) keeps running while they render.
+
+    submit(job, render) queues render(job) to run on the background thread. render must only touch
+    things the main loop does not change, such as a copy of the scene taken when the job was
+    submitted, and must not make OpenGL or pygame display calls (those belong to the main thread).
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = []       # Jobs waiting to run
+        self.current = None     # Job running now
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, job, render):
+        with self.lock:
+            self.pending.append(job)
+        self.jobs.put((job, render))
+        return job
+
+    def run(self):
+        while True:
+            (job, render) = self.jobs.get()
+            if job is None:
+                return
+            with self.lock:
+                self.pending.remove(job)
+                self.current = job
+            if not job.cancelled():
+                try:
+                    render(job)
+                except Exception as error:
+                    job.error = error
+                    traceback.print_exc()
+            with self.lock:
+                self.current = None
+            job.done_event.set()
+
+    # (running job or None, number of jobs waiting)
+    def status(self):
+        with self.lock:
+            return (self.current, len(self.pending))
+
+    def cancel_all(self):
+        with self.lock:
+            jobs = self.pending + ([self.current] if self.current is not None else [])
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    # Cancel everything and wait for the background thread to finish
+    def stop(self):
+        self.cancel_all()
+        self.jobs.put((None, None))
+        self.thread.join()
@@ -5,56 +5,25 @@ from Hit import Hit
 from OpenGL.GL import *
 
 class BoxObj(GeomObj):
+    # normals for each face, in the order the faces are tested in local_intersect
+    NORMALS = (
+        (-1, 0, 0),     # right
+        (0, -1, 0),     # bottom
+        (0, 0, -1),     # front
+        (1, 0, 0),      # left
+        (0, 1, 0),      # top
+        (0, 0, 1),      # back
+    )
+
     def __init__(self):
         super().__init__()
 
-    def draw_side(self, slices_x, slices_y):
-        """ Draw a plane of the specified dimension.
-            The plane is a 2x2 square centered at origin (coordinates go -1 to 1).
-            slices_x and slices_y are the number of divisions in each dimension
-        """
-        textured = hasattr(self, 'texture')
-
-        if textured:
-            glBindTexture(GL_TEXTURE_2D, self.gl_texture)
-            glTexEnvf(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE) # GL_MODULATE for mutliplicative blending
-            glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-            glEnable(GL_TEXTURE_2D) # Enable/Disable each time or OpenGL ALWAYS expects texturing!
-
-        dx = 2/slices_x  # Change in x direction
-        dy = 2/slices_y  # Change in y direction
-
-        glNormal3f(0, 0, 1)
-        y = -1
-        for j in range(slices_y):
-            glBegin(GL_TRIANGLE_STRIP)
-            cx = -1
-            for i in range(slices_x):
-                if textured: glTexCoord2f(cx * 1/2 + 0.5, (y+dy) * 1/2 + 0.5)
-                glVertex3f(cx, y+dy, 0)
-                if textured: glTexCoord2f(cx * 1/2 + 0.5, y * 1/2 + 0.5)
-                glVertex3f(cx, y, 0)
-                cx += dx
-            if textured: glTexCoord2f(1, (y+dy) * 1/2 + 0.5)
-            glVertex3f(1, y+dy, 0)
-            if textured: glTexCoord2f(1, y * 1/2 + 0.5)
-            glVertex3f(1, y, 0)
-            glEnd()
-            y += dy
-
-        # Uncomment if you want to "see" the normal
-        # isEnabled = glIsEnabled(GL_LIGHTING)
-        # if isEnabled: glDisable(GL_LIGHTING)
-        # glBegin(GL_LINES)
-        # glColor3f(1,1,1)
-        # glVertex(0, 0, 0)
-        # glVertex(0, 0, 1)
-        # glEnd()
-        # if isEnabled: glEnable(GL_LIGHTING)
-
-        if textured: glDisable(GL_TEXTURE_2D)
+    def prepare_origin(self, source):
+        super().prepare_origin(source)
+        if source is not None:
+            # Numerators of the six face t values only depend on the ray source
+            s = self.origin_local
+            self.origin_offsets = (-1 - s.x, 1 - s.x, -1 - s.y, 1 - s.y, -1 - s.z, 1 - s.z)
 
     def render_solid(self, slices=10):
         """ Draw a unit cube with one corner at origin in positive octant."""    
@@ -132,34 +101,31 @@ class BoxObj(GeomObj):
           of first contact, and is used to determine which normal is returned based on the face hit
         """
 
-        # normals for each face
-        normals = [
-            Vector3(-1, 0, 0),  # right
-            Vector3(0, -1, 0),  # bottom
-            Vector3(0, 0, -1),  # front
-            Vector3(1, 0, 0),   # left
-            Vector3(0, 1, 0),   # top
-            Vector3(0, 0, 1),   # back
-        ]
-
         # calculate all of the six intersection point t values
         t_values = [None, None, None, None, None, None]
         p_values = [None, None, None, None, None, None]
 
+        # origin-only numerators are cached once per frame for primary rays
+        s = ray.source
+        if s is self.origin_local:
+            (x_lo, x_hi, y_lo, y_hi, z_lo, z_hi) = self.origin_offsets
+        else:
+            (x_lo, x_hi, y_lo, y_hi, z_lo, z_hi) = (-1 - s.x, 1 - s.x, -1 - s.y, 1 - s.y, -1 - s.z, 1 - s.z)
+
         if ray.dir.dx != 0:
-            t_values[0] = (-1 - ray.source.x) / ray.dir.dx              # left
+            t_values[0] = x_lo / ray.dir.dx                             # left
             p_values[0] = ray.eval(t_values[0]) ; p_values[0].x = -1    # prevent round off in irrelevant dimension
-            t_values[3] = (1 - ray.source.x) / ray.dir.dx               # right
+            t_values[3] = x_hi / ray.dir.dx                             # right
             p_values[3] = ray.eval(t_values[3]) ; p_values[3].x = 1     # prevent round off in irrelevant dimension
         if ray.dir.dy != 0:
-            t_values[1] = (-1 - ray.source.y) / ray.dir.dy              # bottom
+            t_values[1] = y_lo / ray.dir.dy                             # bottom
             p_values[1] = ray.eval(t_values[1]) ; p_values[1].y = -1    # prevent round off in irrelevant dimension
-            t_values[4] = (1 - ray.source.y) / ray.dir.dy               # top
+            t_values[4] = y_hi / ray.dir.dy                             # top
             p_values[4] = ray.eval(t_values[4]) ; p_values[4].y = 1     # prevent round off in irrelevant dimension
         if ray.dir.dz != 0:
-            t_values[2] = (-1 - ray.source.z) / ray.dir.dz              # front
+            t_values[2] = z_lo / ray.dir.dz                             # front
             p_values[2] = ray.eval(t_values[2]) ; p_values[2].z = -1    # prevent round off in irrelevant dimension
-            t_values[5] = (1 - ray.source.z) / ray.dir.dz               # back
+            t_values[5] = z_hi / ray.dir.dz                             # back
             p_values[5] = ray.eval(t_values[5]) ; p_values[5].z = 1     # prevent round off in irrelevant dimension
 
         # calculate the points
@@ -186,8 +152,7 @@ class BoxObj(GeomObj):
         
         best_hit.t = t_min
         best_hit.point = ray.eval(t_min)
-        best_hit.norm = normals[t_min_i]
-        best_hit.norm.normalize()   # stress relief normalization
+        best_hit.norm = Vector3(*BoxObj.NORMALS[t_min_i])    # face normals are already unit length
         best_hit.obj = self
 
         # texturing
@@ -11,19 +11,55 @@ class CylinderObj(GeomObj):
     def __init__(self, r_start=1, r_end=1, height=1, resolution=100):
         super().__init__()
 
-        self.tube = gluNewQuadric()
+        self.tube = self.new_quadric()
         self.resolution = resolution
         self.r_start = r_start
         self.r_end = r_end
         self.height = height
-        gluQuadricDrawStyle(self.tube, GLU_FILL)
-        gluQuadricTexture(self.tube, GL_TRUE)
-        gluQuadricNormals(self.tube, GLU_SMOOTH) 
+
+    def new_quadric(self):
+        tube = gluNewQuadric()
+        gluQuadricDrawStyle(tube, GLU_FILL)
+        gluQuadricTexture(tube, GL_TRUE)
+        gluQuadricNormals(tube, GLU_SMOOTH) 
+        return tube
+
+    # Copies leave the quadric behind, as for SphereObj
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['tube'] = None
+        return state
 
     def render_solid(self):
         """ Draw a cylinder aligned at on the z-axis with radius r_start at one end, r_end at the other and height height."""    
+        if self.tube is None:
+            self.tube = self.new_quadric()
         gluCylinder(self.tube, self.r_start, self.r_end, self.height, self.resolution, self.resolution)
 
+    def freeze(self):
+        # Quadric coefficients that only depend on the shape (see local_intersect for the derivation)
+        self.r_lerp = (self.r_end - self.r_start)/self.height    # this is a factor, not actually the radius!
+        self.r_lerp_sq = self.r_lerp**2
+        self.r_start_sq = self.r_start**2
+        self.r_lerp_r_start = self.r_lerp*self.r_start
+        self.norm_z = (self.r_end-self.r_start) / 2
+        super().freeze()
+
+    def prepare_origin(self, source):
+        super().prepare_origin(source)
+        if source is not None:
+            # The constant term of the quadratic only depends on the ray source
+            s = self.origin_local
+            self.origin_c = s.x**2 + s.y**2 - s.z**2*self.r_lerp_sq - 2*s.z*self.r_lerp_r_start - self.r_start_sq
+
+    def local_bounds(self):
+        r = max(self.r_start, self.r_end)
+        return ((-r, -r, 0), (r, r, self.height))
+
+    def local_bounding_sphere(self):
+        r = max(self.r_start, self.r_end)
+        return ((0, 0, self.height / 2), math.sqrt(r**2 + (self.height / 2)**2))
+
     def local_intersect(self, ray, best_hit):
         """
         explanation of logic:
@@ -72,13 +108,20 @@ class CylinderObj(GeomObj):
         if t1 == t2, there is only a collision point (ray is tangent to cylinder).
         """
 
-        # define r_lerp
-        r_lerp = (self.r_end - self.r_start)/self.height    # this is a factor, not actually the radius!
+        # r_lerp and its products are precomputed in freeze
+        r_lerp_sq = self.r_lerp_sq
+        r_lerp_r_start = self.r_lerp_r_start
+        height = self.height
+        (sx, sy, sz) = (ray.source.x, ray.source.y, ray.source.z)
+        (dx, dy, dz) = (ray.dir.dx, ray.dir.dy, ray.dir.dz)
 
         # set up for quadratic formula
-        a = ray.dir.dx**2 + ray.dir.dy**2 - ray.dir.dz**2*r_lerp**2
-        b = 2*ray.source.x*ray.dir.dx + 2*ray.source.y*ray.dir.dy - 2*ray.source.z*ray.dir.dz*r_lerp**2 - 2*ray.dir.dz*r_lerp*self.r_start
-        c = ray.source.x**2 + ray.source.y**2 - ray.source.z**2*r_lerp**2 - 2*ray.source.z*r_lerp*self.r_start - self.r_start**2
+        a = dx**2 + dy**2 - dz**2*r_lerp_sq
+        b = 2*sx*dx + 2*sy*dy - 2*sz*dz*r_lerp_sq - 2*dz*r_lerp_r_start
+        if ray.source is self.origin_local:
+            c = self.origin_c   # cached once per frame for primary rays
+        else:
+            c = sx**2 + sy**2 - sz**2*r_lerp_sq - 2*sz*r_lerp_r_start - self.r_start_sq
 
         # calculate discriminant to figure out number of solutions
         disc = b**2 - 4*a*c
@@ -99,15 +142,15 @@ class CylinderObj(GeomObj):
         invert_for_inside = 1           # default no inversion (outside)
 
         # test t_min, if t_min is ok (not behind start and within bounded cylinder) we are outside
-        if t_min < 0 or (ray.source.z + t_min * ray.dir.dz < 0 or ray.source.z + t_min * ray.dir.dz > self.height):
+        if t_min < 0 or (sz + t_min * dz < 0 or sz + t_min * dz > height):
             invert_for_inside = -1        # since test failed, must be inside, or no valid collision
         # assuming t_max doesn't fail the same test, we are inside
         # if it does fail, it won't draw anyways - no need to change anything again
 
         # clamp
-        if ray.source.z + t1 * ray.dir.dz < 0 or ray.source.z + t1 * ray.dir.dz > self.height:
+        if sz + t1 * dz < 0 or sz + t1 * dz > height:
             t1 = -1   # fail if solution point does not collide with a valid z coordinate for the cylinder
-        if ray.source.z + t2 * ray.dir.dz < 0 or ray.source.z + t2 * ray.dir.dz > self.height:
+        if sz + t2 * dz < 0 or sz + t2 * dz > height:
             t2 = -1   # fail if solution point does not collide with a valid z coordinate for the cylinder
 
         # compare after clamping to figure out which point to use
@@ -120,7 +163,7 @@ class CylinderObj(GeomObj):
         # else new solution
         best_hit.t = t_min
         best_hit.point = ray.eval(t_min)
-        best_hit.norm = Vector3(invert_for_inside * best_hit.point.x, invert_for_inside * best_hit.point.y, invert_for_inside * (self.r_end-self.r_start) / 2)
+        best_hit.norm = Vector3(invert_for_inside * best_hit.point.x, invert_for_inside * best_hit.point.y, invert_for_inside * self.norm_z)
         best_hit.norm.normalize()   # stress relief normalization
         best_hit.obj = self
         best_hit.texture_color = Color(1, 1, 1, 1) # defaults to white
@@ -0,0 +1,140 @@
+import os
+import sys
+import hashlib
+import numpy as np
+from PIL import Image
+
+class FrameCache:
+    """
+    Disk cache of ray traced frames, keyed by what the frame depends on, so rendering the same
+    frame again (the same recording twice, or after a crash) just reads it back.
+
+    A key (see frame_key) hashes the posed scene (objects, materials, textures, lights and scene
+    settings), the camera, the render settings (size, block size, ...) and the source of the modules
+    the scene's classes come from, so editing the renderer does not bring back stale frames.
+    Frames are stored as <key>.npy in directory. Once the files add up to more than max_bytes the
+    least recently used ones are removed (a hit marks a file used by touching it).
+    """
+
+    # Attributes that are caches, counters or per-frame state rather than part of what is rendered
+    SKIP = {
+        'bvh', 'screen_bins', 'shading_tables', 'specular_luts', 'tile_scheduler', 'thread_pool',
+        'thread_pool_size', 'progress', 'verbose', 'frame', 'render_threads',
+        'version', 'geometry_version', 'ball', 'tube',
+    }
+    SKIP_PREFIX = 'origin_'     # Per-frame ray origin caches (see Scene.prepare_origins)
+    source_digests = {}     # Module file -> (modification time, digest of its source)
+
+    def __init__(self, directory='framecache', max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith('.npy'))
+
+    """
+    Key of the frame rendered from scene (a copy the cache may pose) with state applied by
+    apply_state(scene, state), as in RecordPool, followed by any render settings.
+    """
+    @staticmethod
+    def frame_key(scene, apply_state, state, *settings):
+        scene.freeze()
+        apply_state(scene, state)
+        scene.freeze()  # So the derived values hashed with each object match what is rendered
+        return FrameCache.fingerprint(scene, state, settings)
+
+    # Hash of any mix of scene objects, arrays, images and plain values, plus the source of the classes involved
+    @staticmethod
+    def fingerprint(*values):
+        digest = hashlib.sha256()
+        modules = set()
+        FrameCache.hash_value(values, digest, {}, modules)
+        for module in sorted(modules):
+            digest.update(FrameCache.source_digest(module))
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_value(value, digest, seen, modules):
+        if value is None or isinstance(value, (bool, int, float, str, bytes)):
+            digest.update(repr(value).encode())
+        elif isinstance(value, (list, tuple)):
+            digest.update(b'[%d' % len(value))
+            for item in value:
+                FrameCache.hash_value(item, digest, seen, modules)
+            digest.update(b']')
+        elif id(value) in seen:
+            digest.update(b'@%d' % seen[id(value)])    # Shared (or cyclic) reference, hashed once
+        else:
+            seen[id(value)] = len(seen)
+            if isinstance(value, dict):
+                digest.update(b'{')
+                for (key, item) in value.items():
+                    FrameCache.hash_value(key, digest, seen, modules)
+                    FrameCache.hash_value(item, digest, seen, modules)
+                digest.update(b'}')
+            elif isinstance(value, np.ndarray):
+                digest.update(repr((value.dtype.str, value.shape)).encode())
+                digest.update(np.ascontiguousarray(value).data)
+            elif isinstance(value, Image.Image):
+                digest.update(repr((value.mode, value.size)).encode())
+                digest.update(value.tobytes())
+            elif hasattr(value, '__dict__'):
+                cls = type(value)
+                digest.update(cls.__qualname__.encode())
+                modules.add(cls.__module__)
+                for name in sorted(value.__dict__):
+                    if name not in FrameCache.SKIP and not name.startswith(FrameCache.SKIP_PREFIX):
+                        digest.update(name.encode())
+                        FrameCache.hash_value(value.__dict__[name], digest, seen, modules)
+            else:
+                digest.update(repr(value).encode())
+
+    @staticmethod
+    def source_digest(module_name):
+        filename = getattr(sys.modules.get(module_name), '__file__', None)
+        if filename is None:
+            return module_name.encode()
+        mtime = os.path.getmtime(filename)
+        cached = FrameCache.source_digests.get(filename)
+        if cached is None or cached[0] != mtime:
+            with open(filename, 'rb') as file:
+                cached = (mtime, hashlib.sha256(file.read()).digest())
+            FrameCache.source_digests[filename] = cached
+        return cached[1]
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    # The cached pixels for key, or None
+    def get(self, key):
+        path = self.path(key)
+        try:
+            pixels = np.load(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path)  # Most recently used
+        self.hits += 1
+        return pixels
+
+    def put(self, key, pixels):
+        path = self.path(key)
+        temp = path + '.tmp'
+        with open(temp, 'wb') as file:
+            np.save(file, pixels)
+        os.replace(temp, path)  # Never leaves a partly written frame under its key
+        self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    # Remove the least recently used frames until the cache fits in max_bytes again
+    def evict(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.npy')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        self.total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.total_bytes -= entry.stat().st_size
+            os.remove(entry.path)
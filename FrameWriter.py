@@ -0,0 +1,79 @@
+import os
+import queue
+import threading
+import traceback
+import numpy as np
+from PIL import Image
+from RGBPixmap import RGBPixmap
+
+class FrameWriter:
+    """
+    Encodes and writes finished frames on a background thread, so saving one frame overlaps
+    ray tracing the next.
+
+    write(frame, filename) queues a frame: an RGBPixmap is copied (its pixels may be overwritten by
+    the next frame straight away), an array of pixels (rows, cols, 3) is handed over as it is.
+    At most max_pending frames wait at once, after that write blocks until the oldest is written,
+    which keeps memory bounded when frames come faster than they are saved.
+    The extension of filename is replaced by the one for image_format:
+      png   PNG at zlib level png_compression (1 is fast, 9 is small)
+      ppm   uncompressed binary PPM, the pixels are written as they are
+      npy   NumPy array in the pixmap's own format (keeps float pixels as floats)
+    Paths are appended to written as each file is finished. close() waits for every queued frame.
+    """
+
+    FORMATS = ('png', 'ppm', 'npy')
+
+    def __init__(self, image_format='png', max_pending=4, png_compression=1, written=None):
+        if image_format not in FrameWriter.FORMATS:
+            raise ValueError("Unknown frame format {0!r}, expected one of {1}".format(image_format, FrameWriter.FORMATS))
+        self.image_format = image_format
+        self.png_compression = png_compression
+        self.written = [] if written is None else written
+        self.error = None           # First exception raised while writing, if any
+        self.frames = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, frame, filename):
+        if isinstance(frame, RGBPixmap):
+            frame = frame.pixel.copy() if self.image_format == 'npy' else frame.rgb8().copy()
+        filename = os.path.splitext(filename)[0] + '.' + self.image_format
+        self.frames.put((frame, filename))
+        return filename
+
+    def run(self):
+        while True:
+            (pixels, filename) = self.frames.get()
+            if pixels is None:
+                self.frames.task_done()
+                return
+            try:
+                self.encode(pixels, filename)
+                self.written.append(filename)
+            except Exception as error:
+                if self.error is None:
+                    self.error = error
+                traceback.print_exc()
+            self.frames.task_done()
+
+    def encode(self, pixels, filename):
+        if self.image_format == 'npy':
+            np.save(filename, pixels)
+            return
+        if pixels.dtype != np.uint8:
+            pixels = (np.clip(pixels, 0.0, 1.0) * 255).astype(np.uint8)
+        if self.image_format == 'ppm':
+            with open(filename, 'wb') as file:
+                file.write(b'P6\n%d %d\n255\n' % (pixels.shape[1], pixels.shape[0]))
+                file.write(np.ascontiguousarray(pixels).data)
+        else:
+            Image.fromarray(pixels).save(filename, compress_level=self.png_compression)
+
+    # Wait for the frames queued so far to be written
+    def flush(self):
+        self.frames.join()
+
+    def close(self):
+        self.frames.put((None, None))
+        self.thread.join()
@@ -1,14 +1,43 @@
 
+import math
+import threading
+import numpy as np
 from Matrix import Matrix
 from Material import Material
 from Ray import Ray
 from Hit import Hit
 from Color import Color
+from Point3 import Point3
 from Vector3 import Vector3
 from OpenGL.GL import *
 from PIL import Image
 
+# Kinds of object transforms, classified in freeze so intersect can skip work that does nothing
+TRANSFORM_IDENTITY = 0      # No transform at all
+TRANSFORM_TRANSLATE = 1     # Translated only
+TRANSFORM_SCALE = 2         # Axis-aligned (non-uniform) scale plus translation
+TRANSFORM_UNIFORM = 3       # Uniform (positive) scale plus translation
+TRANSFORM_GENERAL = 4       # Anything with a rotation (or shear)
+
+# Bounding sphere tests made by intersect: each thread counts its own [tests, rejects] (so render threads never
+# write the same counters), every thread's list is kept in all_bound_counts to be summed and reset by Scene.report_bound_rejections
+bound_counts = threading.local()
+all_bound_counts = []
+all_bound_counts_lock = threading.Lock()
+
+def new_bound_counts():
+    counts = [0, 0]
+    with all_bound_counts_lock:
+        all_bound_counts.append(counts)
+    bound_counts.counts = counts
+    return counts
+
 class GeomObj:
+    # Decoded images shared by every object using the same file, keyed by (filename, dim)
+    # Each image's pixels are also kept as a read-only array (see image_pixels), made once when the image is loaded
+    texture_cache = {}      # -> [image, OpenGL texture name (or None until first drawn), pixels]
+    normal_map_cache = {}   # -> (image, pixels)
+
     def __init__(self):
         self.material = Material()
         self.matrix = Matrix()
@@ -16,6 +45,14 @@ class GeomObj:
         self.matrix.load_identity()
         self.matrix_inverse.load_identity()
         self.name = "Unknown"   # Use a name to help identify the object for debugging
+        self.frozen = False     # True once the per-ray constants below are computed (see freeze)
+        self.version = 0        # Bumped on every freeze, so acceleration structures can tell what moved
+        self.origin_source = None   # Ray source whose object-space terms are cached (see prepare_origin)
+        self.origin_local = None
+        self.texture_pixels = None      # Shared pixel arrays of the texture and normal map, from the caches above
+        self.normal_map_pixels = None
+        self.frozen_texture = None      # ... as taken by freeze
+        self.frozen_normal_map = None
 
     def prepare_solid(self):
         glMatrixMode(GL_MODELVIEW)
@@ -29,25 +66,281 @@ class GeomObj:
         glMatrixMode(GL_MODELVIEW)
         glPopMatrix()
 
+    def draw_side(self, slices_x, slices_y):
+        """ Draw a plane of the specified dimension.
+            The plane is a 2x2 square centered at origin (coordinates go -1 to 1).
+            slices_x and slices_y are the number of divisions in each dimension
+        """
+        textured = hasattr(self, 'texture')
+
+        if textured:
+            glBindTexture(GL_TEXTURE_2D, self.get_gl_texture())
+            glTexEnvf(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE) # GL_MODULATE for mutliplicative blending
+            glHint(GL_PERSPECTIVE_CORRECTION_HINT, GL_NICEST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glEnable(GL_TEXTURE_2D) # Enable/Disable each time or OpenGL ALWAYS expects texturing!
+
+        dx = 2/slices_x  # Change in x direction
+        dy = 2/slices_y  # Change in y direction
+
+        glNormal3f(0, 0, 1)
+        y = -1
+        for j in range(slices_y):
+            glBegin(GL_TRIANGLE_STRIP)
+            cx = -1
+            for i in range(slices_x):
+                if textured: glTexCoord2f(cx * 1/2 + 0.5, (y+dy) * 1/2 + 0.5)
+                glVertex3f(cx, y+dy, 0)
+                if textured: glTexCoord2f(cx * 1/2 + 0.5, y * 1/2 + 0.5)
+                glVertex3f(cx, y, 0)
+                cx += dx
+            if textured: glTexCoord2f(1, (y+dy) * 1/2 + 0.5)
+            glVertex3f(1, y+dy, 0)
+            if textured: glTexCoord2f(1, y * 1/2 + 0.5)
+            glVertex3f(1, y, 0)
+            glEnd()
+            y += dy
+
+        # Uncomment if you want to "see" the normal
+        # isEnabled = glIsEnabled(GL_LIGHTING)
+        # if isEnabled: glDisable(GL_LIGHTING)
+        # glBegin(GL_LINES)
+        # glColor3f(1,1,1)
+        # glVertex(0, 0, 0)
+        # glVertex(0, 0, 1)
+        # glEnd()
+        # if isEnabled: glEnable(GL_LIGHTING)
+
+        if textured: glDisable(GL_TEXTURE_2D)
+
     def set_material(self, material):
         self.material = material
+        self.thaw()
 
     def translate(self, dx, dy, dz):
         self.matrix.post_translate(dx, dy, dz)
         self.matrix_inverse.pre_translate(-dx, -dy, -dz)
+        self.thaw()
 
     def scale(self, sx, sy, sz):
         self.matrix.post_scale(sx, sy, sz)
         self.matrix_inverse.pre_scale(1.0 / sx, 1.0 / sy, 1.0 / sz)
+        self.thaw()
 
     def rotate(self, angle, axis):
         self.matrix.post_rotate(angle, axis)
         self.matrix_inverse.pre_rotate(-angle, axis)
+        self.thaw()
+
+    # FREEZING
+    """
+    Precompute everything the ray tracer reads per ray that does not change during a frame:
+      - the inverse transform as twelve local floats (the bottom row of an affine matrix is always 0 0 0 1)
+      - the world-space bounding box and bounding sphere
+      - handles to the material, texture and normal map
+    Subclasses extend this with their own shape constants (and must call super().freeze()).
+    Any edit through translate/scale/rotate/set_material/set_texture/set_normal_map thaws the
+    object again, and intersect re-freezes it automatically before the next test.
+    """
+    def freeze(self):
+        m = self.matrix_inverse.m
+        self.inv_rows = (
+            m[0], m[4], m[8], m[12],
+            m[1], m[5], m[9], m[13],
+            m[2], m[6], m[10], m[14]
+        )
+        self.transform_kind = self.classify_transform()
+        self.origin_source = None   # any cached origin was in the old object space
+        self.origin_local = None
+
+        # World-space bounding box: transform the eight corners of the local box
+        bounds = self.local_bounds()
+        if bounds is None:
+            # Unbounded shapes (planes) get no box and an infinite sphere, so nothing ever culls them
+            self.world_min = None
+            self.world_max = None
+            self.world_center = (0, 0, 0)
+            self.world_radius = math.inf
+            self.bound_radius_sq = math.inf
+        else:
+            (lo, hi) = bounds
+            corners = [self.matrix.affine_mult_point(Point3(x, y, z)) for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])]
+            self.world_min = (min(p.x for p in corners), min(p.y for p in corners), min(p.z for p in corners))
+            self.world_max = (max(p.x for p in corners), max(p.y for p in corners), max(p.z for p in corners))
+
+            # World-space bounding sphere: the local sphere grows by the largest stretch of the transform
+            (center, radius) = self.local_bounding_sphere()
+            m = self.matrix.m
+            stretch = max(
+                math.sqrt(m[0] ** 2 + m[1] ** 2 + m[2] ** 2),
+                math.sqrt(m[4] ** 2 + m[5] ** 2 + m[6] ** 2),
+                math.sqrt(m[8] ** 2 + m[9] ** 2 + m[10] ** 2)
+            )
+            c = self.matrix.affine_mult_point(Point3(center[0], center[1], center[2]))
+            self.world_center = (c.x, c.y, c.z)
+            self.world_radius = radius * stretch
+            self.bound_radius_sq = (self.world_radius * (1 + 1e-9) + 1e-9) ** 2   # padded so round off never rejects a real hit
+
+        self.frozen_material = self.material
+        # Pixels as read-only arrays: PIL images load their pixel access lazily, which is not safe across render threads.
+        # The arrays are shared with every object using the same image, so nothing is copied here
+        self.frozen_texture = self.texture_pixels
+        self.frozen_normal_map = self.normal_map_pixels
+        self.version += 1
+        self.frozen = True
+
+    """
+    Classify the current transform into one of the TRANSFORM_* kinds.
+    Only exact zeros/ones count, so the fast paths in intersect give the same hits as the general one.
+    """
+    def classify_transform(self):
+        m = self.matrix.m
+        if m[1] != 0 or m[2] != 0 or m[4] != 0 or m[6] != 0 or m[8] != 0 or m[9] != 0:
+            return TRANSFORM_GENERAL
+        (sx, sy, sz) = (m[0], m[5], m[10])
+        if sx == 1 and sy == 1 and sz == 1:
+            if m[12] == 0 and m[13] == 0 and m[14] == 0:
+                return TRANSFORM_IDENTITY
+            return TRANSFORM_TRANSLATE
+        if sx == sy and sy == sz and sx > 0:
+            return TRANSFORM_UNIFORM    # A negative factor flips the normal, which the uniform fast path does not do
+        return TRANSFORM_SCALE
+
+    """
+    Cache the object-space position of a ray source shared by many rays (the camera eye for primary rays)
+    along with any origin-only terms of the intersection test, so those rays only do direction-dependent work.
+    Subclasses extend this with their own terms (and must call super().prepare_origin(source)).
+    Passing None clears the cache.
+    """
+    def prepare_origin(self, source):
+        if not self.frozen:
+            self.freeze()
+        self.origin_source = source
+        if source is None:
+            self.origin_local = None
+            self.origin_bound = None
+            return
+        (cx, cy, cz) = self.world_center
+        (ox, oy, oz) = (cx - source.x, cy - source.y, cz - source.z)
+        self.origin_bound = (ox, oy, oz, ox * ox + oy * oy + oz * oz - self.bound_radius_sq)
+        if self.transform_kind == TRANSFORM_IDENTITY:
+            self.origin_local = source  # local_intersect sees the world ray itself
+        else:
+            (a0, a1, a2, a3, b0, b1, b2, b3, c0, c1, c2, c3) = self.inv_rows
+            s = source
+            self.origin_local = Point3(a0 * s.x + a1 * s.y + a2 * s.z + a3, b0 * s.x + b1 * s.y + b2 * s.z + b3, c0 * s.x + c1 * s.y + c2 * s.z + c3)
+
+    """
+    Cheap early out for intersect: true if the ray misses the world-space bounding sphere,
+    or only reaches it at or beyond the current best hit (so no closer hit is possible).
+    For a ray s + t*d and a sphere with center c, the sphere is entered at
+      t_near = (b - sqrt(b**2 - a*k)) / a   with a = d.d, b = (c-s).d, k = (c-s).(c-s) - r**2
+    """
+    def misses_bounds(self, ray, best_hit):
+        try:
+            counts = bound_counts.counts
+        except AttributeError:
+            counts = new_bound_counts()     # First test on this thread
+        counts[0] += 1
+        s = ray.source
+        d = ray.dir
+        if s is self.origin_source:
+            (ox, oy, oz, k) = self.origin_bound
+        else:
+            (cx, cy, cz) = self.world_center
+            (ox, oy, oz) = (cx - s.x, cy - s.y, cz - s.z)
+            k = ox * ox + oy * oy + oz * oz - self.bound_radius_sq
+        if k <= 0:
+            return False    # source is inside the sphere, so it cannot rule anything out
+        b = ox * d.dx + oy * d.dy + oz * d.dz
+        if b <= 0:
+            counts[1] += 1     # sphere is entirely behind the source
+            return True
+        a = d.dx * d.dx + d.dy * d.dy + d.dz * d.dz
+        disc = b * b - a * k
+        if disc < 0 or (best_hit.t != -1 and b - math.sqrt(disc) >= best_hit.t * a):
+            counts[1] += 1
+            return True
+        return False
+
+    # A read-only copy of an image's pixels (rows first), made once per cached image
+    @staticmethod
+    def image_pixels(image):
+        pixels = np.asarray(image)
+        pixels.flags.writeable = False
+        return pixels
+
+    def thaw(self):
+        # Mark the frozen constants as stale, they are rebuilt on the next intersection test
+        self.frozen = False
+
+    """
+    Bounds of the shape in OBJECT space as ((min_x, min_y, min_z), (max_x, max_y, max_z)).
+    Defaults to the unit cube [-1, 1] used by boxes and spheres. Unbounded shapes return None.
+    """
+    def local_bounds(self):
+        return ((-1, -1, -1), (1, 1, 1))
+
+    """
+    Bounding sphere of the shape in OBJECT space as ((x, y, z), radius).
+    Defaults to the sphere around local_bounds, subclasses can provide a tighter one.
+    """
+    def local_bounding_sphere(self):
+        bounds = self.local_bounds()
+        if bounds is None:
+            return None
+        (lo, hi) = bounds
+        center = ((lo[0] + hi[0]) / 2, (lo[1] + hi[1]) / 2, (lo[2] + hi[2]) / 2)
+        radius = math.sqrt((hi[0] - center[0]) ** 2 + (hi[1] - center[1]) ** 2 + (hi[2] - center[2]) ** 2)
+        return (center, radius)
 
     def intersect(self, ray, best_hit):
+        if not self.frozen:
+            self.freeze()
+        if self.misses_bounds(ray, best_hit):
+            return False
+        kind = self.transform_kind
+        if kind == TRANSFORM_GENERAL:
+            return self.intersect_general(ray, best_hit)
+
+        # Specialized paths: the inverse has no rotation so each axis is handled on its own
+        (a0, a1, a2, a3, b0, b1, b2, b3, c0, c1, c2, c3) = self.inv_rows
+        s = ray.source
+        if kind == TRANSFORM_IDENTITY:
+            # Object space is world space, local_intersect already leaves everything in world space
+            return self.local_intersect(ray, best_hit)
+        if kind == TRANSFORM_TRANSLATE:
+            local_source = self.origin_local if s is self.origin_source else Point3(s.x + a3, s.y + b3, s.z + c3)
+            transformed_ray = Ray(local_source, ray.dir)
+            if self.local_intersect(transformed_ray, best_hit):
+                best_hit.point = ray.eval(best_hit.t)
+                return True   # normal is unchanged by a translation
+            return False
+
+        d = ray.dir
+        transformed_ray = Ray(
+            self.origin_local if s is self.origin_source else Point3(a0 * s.x + a3, b1 * s.y + b3, c2 * s.z + c3),
+            Vector3(a0 * d.dx, b1 * d.dy, c2 * d.dz)
+        )
+        if self.local_intersect(transformed_ray, best_hit):
+            best_hit.point = ray.eval(best_hit.t)
+            if kind == TRANSFORM_SCALE:
+                # Inverse transpose of a diagonal matrix is itself
+                n = best_hit.norm
+                best_hit.norm = Vector3(a0 * n.dx, b1 * n.dy, c2 * n.dz)
+                best_hit.norm.normalize()
+            # A uniform scale keeps the (already unit) local normal's direction
+            return True
+        return False
+
+    def intersect_general(self, ray, best_hit):
+        (a0, a1, a2, a3, b0, b1, b2, b3, c0, c1, c2, c3) = self.inv_rows
+        s = ray.source
+        d = ray.dir
         transformed_ray = Ray(
-            self.matrix_inverse.affine_mult_point(ray.source),
-            self.matrix_inverse.affine_mult_vector(ray.dir)
+            self.origin_local if s is self.origin_source else Point3(a0 * s.x + a1 * s.y + a2 * s.z + a3, b0 * s.x + b1 * s.y + b2 * s.z + b3, c0 * s.x + c1 * s.y + c2 * s.z + c3),
+            Vector3(a0 * d.dx + a1 * d.dy + a2 * d.dz, b0 * d.dx + b1 * d.dy + b2 * d.dz, c0 * d.dx + c1 * d.dy + c2 * d.dz)
         )
         if self.local_intersect(transformed_ray, best_hit):
             # Need to recompute the hit point in WORLD SPACE (using original ray)
@@ -55,7 +348,8 @@ class GeomObj:
 
             # Transform the normal in best_hit from OBJECT space to WORLD space
             # using the inverse transpose
-            best_hit.norm = self.matrix_inverse.affine_transpose_mult_vector(best_hit.norm)
+            n = best_hit.norm
+            best_hit.norm = Vector3(a0 * n.dx + b0 * n.dy + c0 * n.dz, a1 * n.dx + b1 * n.dy + c1 * n.dz, a2 * n.dx + b2 * n.dy + c2 * n.dz)
             best_hit.norm.normalize()
             return True
         return False
@@ -79,19 +373,37 @@ class GeomObj:
     Attaching a texture to the shape.
     Textures will always fill the entire shape, and are not tiled.
     Requires all loaded textures to be square
+    Decoded images are shared between all objects using the same file and dimension.
 
     filename: Name of file relative to base directory (usually will be 'resources/file.png')
     dim: Dimension of the image (MUST BE SQUARE)
     """
     def set_texture(self, filename, dim):
         self.texture_dim = dim
-        self.texture = Image.open(filename)
-        self.texture = self.texture.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
-        texture_bytes = self.texture.tobytes('raw')
+        self.texture_key = (filename, dim)
+        if self.texture_key not in GeomObj.texture_cache:
+            texture = Image.open(filename)
+            texture = texture.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
+            GeomObj.texture_cache[self.texture_key] = [texture, None, GeomObj.image_pixels(texture)]
+        entry = GeomObj.texture_cache[self.texture_key]
+        self.texture = entry[0]
+        self.texture_pixels = entry[2]
+        self.thaw()
 
-        self.gl_texture = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.gl_texture)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, dim, dim, 0, GL_RGBA, GL_UNSIGNED_BYTE, texture_bytes)
+    """
+    OpenGL name of the texture, uploaded the first time it is needed (this requires a current GL context).
+    The upload is shared with every other object using the same file.
+    """
+    def get_gl_texture(self):
+        # setdefault: objects unpickled in another process arrive with an empty cache
+        entry = GeomObj.texture_cache.setdefault(self.texture_key, [self.texture, None, self.texture_pixels])
+        if entry[1] is None:
+            dim = self.texture_dim
+            texture_bytes = entry[0].tobytes('raw')
+            entry[1] = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_2D, entry[1])
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, dim, dim, 0, GL_RGBA, GL_UNSIGNED_BYTE, texture_bytes)
+        return entry[1]
 
     """
     Helper method to get a pixel from the texture of any given size.
@@ -101,8 +413,11 @@ class GeomObj:
     Returns: Color from texture
     """
     def get_texture_pixel_color(self, x, y):
+        if not self.frozen:
+            self.freeze()   # E.g. looked up before the first render, or right after set_texture
         # if no texture is loaded, use white
-        if not hasattr(self, 'texture_dim') or not hasattr(self, 'texture'):
+        texture = self.frozen_texture
+        if texture is None:
             # print(f'{self.name} has no dim/texture, using white!')
             return Color(1, 1, 1, 1)
         # print(f'looking for color at ({x}, {y})')
@@ -111,8 +426,8 @@ class GeomObj:
         tx = round((self.texture_dim - 1) * x)
         ty = round((self.texture_dim - 1) * y)
 
-        # grab pixel colors from image file
-        (r, g, b, a) = self.texture.getpixel((tx, ty))
+        # grab pixel colors from image file (rows first in the array)
+        (r, g, b, a) = texture[ty, tx].tolist()
 
         return Color(r / 255, g / 255, b / 255, a / 255)
 
@@ -125,9 +440,14 @@ class GeomObj:
     dim: Dimension of the image (MUST BE SQUARE)
     """
     def set_normal_map(self, filename):
-        self.normal_map = Image.open(filename)
-        self.normal_map = self.normal_map.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
-        self.normal_map = self.normal_map.resize((self.texture_dim, self.texture_dim))
+        key = (filename, self.texture_dim)
+        if key not in GeomObj.normal_map_cache:
+            normal_map = Image.open(filename)
+            normal_map = normal_map.transpose(method=Image.Transpose.FLIP_TOP_BOTTOM)
+            normal_map = normal_map.resize((self.texture_dim, self.texture_dim))
+            GeomObj.normal_map_cache[key] = (normal_map, GeomObj.image_pixels(normal_map))
+        (self.normal_map, self.normal_map_pixels) = GeomObj.normal_map_cache[key]
+        self.thaw()
 
     """
     Helper method to get a pixel from the normal map of any given size.
@@ -137,16 +457,19 @@ class GeomObj:
     Returns: Vector from normal
     """
     def get_normal_map_pixel_vector(self, x, y):
+        if not self.frozen:
+            self.freeze()
         # if no map is loaded, use white
-        if not hasattr(self, 'texture_dim') or not hasattr(self, 'normal_map'):
+        normal_map = self.frozen_normal_map
+        if normal_map is None:
             return Vector3(0, 0, 0)
 
         # change coordinates to be integers relative to dimensions
         nmx = round((self.texture_dim - 1) * x)
         nmy = round((self.texture_dim - 1) * y)
 
-        # grab pixel colors from image file
-        (x, y, z, _) = self.normal_map.getpixel((nmx, nmy))
+        # grab pixel colors from image file (rows first in the array)
+        (x, y, z, _) = normal_map[nmy, nmx].tolist()
 
         # adjustments to match format
         x = (x / 255) * 2 - 1
@@ -0,0 +1,48 @@
+from GeomObj import GeomObj
+
+class InstanceObj(GeomObj):
+    """
+    A placement of shared geometry: any GeomObj (primitive or mesh, with its acceleration
+    structure and texture) used in its own OBJECT space. The prototype's transform is ignored.
+    Each instance only holds its own transform and, optionally, a material overriding the
+    prototype's, so thousands of instances cost little more than one prototype.
+    The prototype does not need to be added to the scene itself.
+    """
+
+    def __init__(self, geometry, material=None):
+        super().__init__()
+        self.geometry = geometry
+        self.material = material if material is not None else geometry.material
+        self.name = "Instance of {0}".format(geometry.name)
+        self.geometry_version = -1  # geometry.version the frozen bounds were taken from
+
+    # An instance is also stale when its prototype changed since the instance was frozen
+    @property
+    def frozen(self):
+        return self._frozen and self.geometry.frozen and self.geometry.version == self.geometry_version
+
+    @frozen.setter
+    def frozen(self, value):
+        self._frozen = value
+
+    def freeze(self):
+        if not self.geometry.frozen:
+            self.geometry.freeze()
+        self.geometry_version = self.geometry.version
+        super().freeze()
+
+    def local_bounds(self):
+        return self.geometry.local_bounds()
+
+    def local_bounding_sphere(self):
+        return self.geometry.local_bounding_sphere()
+
+    def render_solid(self):
+        # prepare_solid already applied this instance's transform and material
+        self.geometry.render_solid()
+
+    def local_intersect(self, ray, best_hit):
+        if self.geometry.local_intersect(ray, best_hit):
+            best_hit.obj = self     # so shading uses this instance's material
+            return True
+        return False
@@ -29,7 +29,8 @@ class Light:
 
     @staticmethod
     def set_global_ambient(ambient):
-        Light.globalAmbient = ambient
+        # Kept as a copy, so later changes to the caller's Color cannot reach a frame being ray traced
+        Light.globalAmbient = Color(*ambient.rgba)
 
     @staticmethod
     def get_global_ambient():
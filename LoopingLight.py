@@ -0,0 +1,28 @@
+import math
+
+class LoopingLight:
+    """
+    Places the light that main_simple moves in a circle of radius distance around the origin,
+    and poses a copy of the scene for a recorded state (camera, light angle in degrees).
+
+    apply_state is what main_simple hands to RecordPool, TilePool and RenderCoordinator. It lives
+    here rather than in main_simple so it can be unpickled anywhere the renderer's modules are,
+    including a RenderWorker started by hand, where main_simple is not the script being run.
+    """
+
+    def __init__(self, distance=5):
+        self.distance = distance
+
+    def place(self, light, angle):
+        pos_x = self.distance * math.cos(math.radians(angle))
+        pos_y = self.distance * math.sin(math.radians(angle))
+        pos_z = 0
+
+        light.set_position(pos_x, pos_y, pos_z)
+        light.obj.reset()
+        light.obj.translate(pos_x, pos_y, pos_z)
+        light.obj.scale(0.2, 0.2, 0.2)
+
+    # Pose a copy of the scene (e.g. in a RecordPool worker) to match a state from main_simple.get_copy_state
+    def apply_state(self, scene, state):
+        self.place(scene.lights[0], state[1])   # lightA is the first light added in main_simple.init_scene
@@ -0,0 +1,101 @@
+import os
+import json
+import struct
+import numpy as np
+
+class MeshCache:
+    """
+    Binary on-disk format for the arrays of a mesh (vertices, faces and its BVH),
+    opened with numpy.memmap so loading is zero-copy. Every process mapping the same
+    cache file shares its pages through the OS page cache instead of holding its own copy.
+
+    Layout:
+      8 bytes   magic b'MESHCACH'
+      4 bytes   format version (little endian uint32)
+      4 bytes   length of the JSON header (little endian uint32)
+      JSON header describing each array (dtype, shape, byte offset) and the source file it was built from
+      array data, each array starting on an ALIGNMENT byte boundary
+    """
+
+    MAGIC = b'MESHCACH'
+    VERSION = 1
+    ALIGNMENT = 64
+    SUFFIX = '.meshcache'
+
+    @staticmethod
+    def cache_name(source):
+        return source + MeshCache.SUFFIX
+
+    """
+    Identify the source file by size and modification time, so a stale cache is rebuilt.
+    """
+    @staticmethod
+    def source_stamp(source):
+        stat = os.stat(source)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    """
+    Write arrays (a dict of name -> NumPy array) to filename.
+    The file is written under a temporary name first, so other processes never map a partial file.
+    """
+    @staticmethod
+    def save(filename, arrays, source=None):
+        entries = []
+        offset = 0
+        for (name, array) in arrays.items():
+            array = np.ascontiguousarray(array)
+            dtype = array.dtype.newbyteorder('<') if array.dtype.byteorder == '>' else array.dtype
+            entries.append({'name': name, 'dtype': dtype.str, 'shape': list(array.shape), 'offset': offset})
+            offset += MeshCache.aligned(array.nbytes)
+        header = {'arrays': entries, 'source': MeshCache.source_stamp(source) if source is not None else None}
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = MeshCache.aligned(16 + len(header_bytes))
+
+        temp_name = '{0}.{1}.tmp'.format(filename, os.getpid())
+        try:
+            with open(temp_name, 'wb') as file:
+                file.write(MeshCache.MAGIC)
+                file.write(struct.pack('<II', MeshCache.VERSION, len(header_bytes)))
+                file.write(header_bytes)
+                for (entry, array) in zip(entries, arrays.values()):
+                    file.seek(data_start + entry['offset'])
+                    file.write(np.ascontiguousarray(array, dtype=entry['dtype']).tobytes())
+                file.truncate(data_start + offset)
+            os.replace(temp_name, filename)
+        except OSError:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)    # E.g. the disk filled up, do not leave a partial file behind
+            raise
+
+    """
+    Map every array of a cache file read-only. Returns a dict of name -> numpy.memmap,
+    or None if the file is missing, not a cache, or was built from a different version of source.
+    """
+    @staticmethod
+    def load(filename, source=None):
+        try:
+            with open(filename, 'rb') as file:
+                if file.read(8) != MeshCache.MAGIC:
+                    return None
+                (version, header_length) = struct.unpack('<II', file.read(8))
+                if version != MeshCache.VERSION:
+                    return None
+                header = json.loads(file.read(header_length).decode('utf-8'))
+            if source is not None and header['source'] != MeshCache.source_stamp(source):
+                return None
+        except (OSError, ValueError, struct.error):
+            return None
+
+        data_start = MeshCache.aligned(16 + header_length)
+        arrays = {}
+        for entry in header['arrays']:
+            shape = tuple(entry['shape'])
+            if 0 in shape:
+                arrays[entry['name']] = np.zeros(shape, dtype=entry['dtype'])   # memmap cannot map empty arrays
+            else:
+                arrays[entry['name']] = np.memmap(filename, dtype=entry['dtype'], mode='r', offset=data_start + entry['offset'], shape=shape)
+        return arrays
+
+    @staticmethod
+    def aligned(size):
+        return (size + MeshCache.ALIGNMENT - 1) // MeshCache.ALIGNMENT * MeshCache.ALIGNMENT
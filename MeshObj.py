@@ -0,0 +1,259 @@
+import math
+import numpy as np
+from GeomObj import GeomObj
+from BVH import BVH
+from MeshCache import MeshCache
+from Vector3 import Vector3
+from Color import Color
+from OpenGL.GL import *
+
+class MeshObj(GeomObj):
+    """
+    Triangle mesh, usually loaded from a Wavefront OBJ file.
+
+    Vertices and triangle indices are kept in compact NumPy arrays (float32 and int32),
+    and the triangles are intersected through the mesh's own BVH in object space.
+    The BVH is stored as two flat arrays as well:
+      node_bounds: (min_x, min_y, min_z, max_x, max_y, max_z) for every node
+      node_links:  (left, right, 0) for inner nodes, (first, 0, count) for leaves
+    Node 0 is the root and leaves refer to a contiguous run of faces, which are reordered to match.
+
+    Parsed meshes are written to a binary cache file next to the OBJ (see MeshCache) and the
+    arrays are memory-mapped from there, so later runs and other processes load them zero-copy.
+    """
+
+    LEAF_SIZE = 8
+    CACHED_ARRAYS = ('vertices', 'faces', 'node_bounds', 'node_links')
+
+    def __init__(self, filename=None, use_cache=True):
+        super().__init__()
+        self.cache_file = None      # Set when the arrays are memory-mapped from a MeshCache file
+        self.vertices = np.zeros((0, 3), dtype=np.float32)
+        self.faces = np.zeros((0, 3), dtype=np.int32)
+        self.node_bounds = np.zeros((0, 6), dtype=np.float32)
+        self.node_links = np.zeros((0, 3), dtype=np.int32)
+        self.vertex_normals = None  # Only computed when drawn with OpenGL
+        if filename is not None:
+            self.load(filename, use_cache)
+
+    """
+    Load a mesh from an OBJ file, or directly from a .meshcache file.
+    With use_cache, an up to date cache next to the OBJ is mapped instead of parsing it,
+    and a missing or stale one is (re)built after parsing. If the cache cannot be written
+    (e.g. the OBJ is in a read-only directory) the parsed arrays are used as they are.
+    """
+    def load(self, filename, use_cache=True):
+        if filename.endswith(MeshCache.SUFFIX):
+            self.map_cache(filename)
+            return
+        if not use_cache:
+            self.load_obj(filename)
+            return
+        cache_file = MeshCache.cache_name(filename)
+        arrays = MeshCache.load(cache_file, source=filename)
+        if arrays is None:
+            self.load_obj(filename)
+            try:
+                MeshCache.save(cache_file, {name: getattr(self, name) for name in MeshObj.CACHED_ARRAYS}, source=filename)
+            except OSError as error:
+                print("Could not write mesh cache '{0}' ({1}), using the parsed mesh".format(cache_file, error))
+                return
+        # Map the cache even right after writing it, so the parsed copies are released
+        self.map_cache(cache_file)
+
+    def map_cache(self, cache_file):
+        arrays = MeshCache.load(cache_file)
+        if arrays is None:
+            raise ValueError("'{0}' is not a valid mesh cache".format(cache_file))
+        for name in MeshObj.CACHED_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.cache_file = cache_file
+        self.vertex_normals = None
+        self.thaw()
+
+    # Pickling (e.g. sending the scene to worker processes) only sends the cache file name for mapped meshes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['vertex_normals'] = None
+        if self.cache_file is not None:
+            for name in MeshObj.CACHED_ARRAYS:
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.cache_file is not None:
+            self.map_cache(self.cache_file)
+
+    """
+    Load the vertices and faces of a Wavefront OBJ file.
+    Only the vertex positions are used, polygons are split into triangle fans.
+    """
+    def load_obj(self, filename):
+        vertices = []
+        faces = []
+        with open(filename) as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) == 0:
+                    continue
+                if parts[0] == 'v':
+                    vertices.append((float(parts[1]), float(parts[2]), float(parts[3])))
+                elif parts[0] == 'f':
+                    # Entries look like v, v/vt, v//vn or v/vt/vn with 1-based (or negative, relative) indices
+                    polygon = []
+                    for entry in parts[1:]:
+                        index = int(entry.split('/')[0])
+                        polygon.append(index - 1 if index > 0 else len(vertices) + index)
+                    for i in range(1, len(polygon) - 1):
+                        faces.append((polygon[0], polygon[i], polygon[i + 1]))
+        self.set_geometry(np.array(vertices, dtype=np.float32).reshape(-1, 3), np.array(faces, dtype=np.int32).reshape(-1, 3))
+
+    def set_geometry(self, vertices, faces):
+        (self.faces, self.node_bounds, self.node_links) = MeshObj.build_bvh(vertices, faces, MeshObj.LEAF_SIZE)
+        self.vertices = vertices
+        self.vertex_normals = None
+        self.cache_file = None
+        self.thaw()
+
+    """
+    Build a BVH over the triangles by splitting at the median centroid along the widest axis.
+    Returns the faces reordered to match the leaves, and the node_bounds and node_links arrays.
+    """
+    @staticmethod
+    def build_bvh(vertices, faces, leaf_size):
+        if len(faces) == 0:
+            return (faces, np.zeros((0, 6), dtype=np.float32), np.zeros((0, 3), dtype=np.int32))
+        triangles = vertices[faces]
+        tri_lo = triangles.min(axis=1)
+        tri_hi = triangles.max(axis=1)
+        centroids = (tri_lo + tri_hi) / 2
+        del triangles
+
+        order = np.arange(len(faces))
+        bounds = []
+        links = []
+
+        def build_range(start, end):
+            index = order[start:end]
+            node = len(bounds)
+            bounds.append(np.concatenate((tri_lo[index].min(axis=0), tri_hi[index].max(axis=0))))
+            links.append(None)
+            count = end - start
+            if count <= leaf_size:
+                links[node] = (start, 0, count)
+                return node
+            c = centroids[index]
+            axis = int(np.argmax(c.max(axis=0) - c.min(axis=0)))
+            mid = count // 2
+            order[start:end] = index[np.argpartition(c[:, axis], mid)]
+            left = build_range(start, start + mid)
+            right = build_range(start + mid, end)
+            links[node] = (left, right, 0)
+            return node
+
+        build_range(0, len(faces))
+        return (np.ascontiguousarray(faces[order]), np.array(bounds, dtype=np.float32), np.array(links, dtype=np.int32))
+
+    def local_bounds(self):
+        if len(self.node_bounds) == 0:
+            return ((0, 0, 0), (0, 0, 0))
+        b = self.node_bounds[0].tolist()
+        return ((b[0], b[1], b[2]), (b[3], b[4], b[5]))
+
+    def render_solid(self):
+        if len(self.faces) == 0:
+            return
+        if self.vertex_normals is None:
+            # Smooth normals for the preview: sum the (area weighted) face normals at each vertex
+            triangles = self.vertices[self.faces]
+            face_normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+            normals = np.zeros(self.vertices.shape, dtype=np.float32)
+            for i in range(3):
+                np.add.at(normals, self.faces[:, i], face_normals)
+            self.vertex_normals = normals
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, self.vertices)
+        glNormalPointer(GL_FLOAT, 0, self.vertex_normals)
+        glDrawElements(GL_TRIANGLES, self.faces.size, GL_UNSIGNED_INT, self.faces)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+    def local_intersect(self, ray, best_hit):
+        if len(self.faces) == 0:
+            return False
+        s = ray.source
+        d = ray.dir
+        (sx, sy, sz) = (s.x, s.y, s.z)
+        (ix, iy, iz) = (1 / d.dx if d.dx != 0 else math.inf, 1 / d.dy if d.dy != 0 else math.inf, 1 / d.dz if d.dz != 0 else math.inf)
+        t_best = best_hit.t if best_hit.t != -1 else math.inf
+        hit = None
+
+        bounds = self.node_bounds
+        links = self.node_links
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            box = bounds[node].tolist()
+            if not BVH.hits_box(sx, sy, sz, ix, iy, iz, (box[0] - BVH.PAD, box[1] - BVH.PAD, box[2] - BVH.PAD), (box[3] + BVH.PAD, box[4] + BVH.PAD, box[5] + BVH.PAD), t_best):
+                continue
+            (a, b, count) = links[node].tolist()
+            if count > 0:
+                leaf_hit = self.intersect_triangles(s, d, a, count, t_best)
+                if leaf_hit is not None:
+                    (t_best, hit) = (leaf_hit[0], leaf_hit[1])
+            else:
+                stack.append(b)
+                stack.append(a)
+
+        if hit is None:
+            return False
+        best_hit.t = t_best
+        best_hit.point = ray.eval(t_best)
+        # Flat face normal, flipped to face the incoming ray so both sides of the mesh are lit
+        (nx, ny, nz) = hit
+        if nx * d.dx + ny * d.dy + nz * d.dz > 0:
+            (nx, ny, nz) = (-nx, -ny, -nz)
+        best_hit.norm = Vector3(nx, ny, nz)
+        best_hit.norm.normalize()
+        best_hit.obj = self
+        best_hit.texture_color = Color(1, 1, 1, 1) # meshes are not textured
+        return True
+
+    """
+    Moller-Trumbore test of the ray against the faces first..first+count, all at once.
+    Returns (t, normal) of the closest hit in (0, t_max), or None.
+    """
+    def intersect_triangles(self, s, d, first, count, t_max):
+        triangles = self.vertices[self.faces[first:first + count]].astype(np.float64)
+        v0 = triangles[:, 0]
+        e1 = triangles[:, 1] - v0
+        e2 = triangles[:, 2] - v0
+        (e1x, e1y, e1z) = (e1[:, 0], e1[:, 1], e1[:, 2])
+        (e2x, e2y, e2z) = (e2[:, 0], e2[:, 1], e2[:, 2])
+
+        # p = d x e2, det = e1 . p
+        px = d.dy * e2z - d.dz * e2y
+        py = d.dz * e2x - d.dx * e2z
+        pz = d.dx * e2y - d.dy * e2x
+        det = e1x * px + e1y * py + e1z * pz
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_det = 1 / det
+            tx = s.x - v0[:, 0]
+            ty = s.y - v0[:, 1]
+            tz = s.z - v0[:, 2]
+            u = (tx * px + ty * py + tz * pz) * inv_det
+            # q = (s - v0) x e1
+            qx = ty * e1z - tz * e1y
+            qy = tz * e1x - tx * e1z
+            qz = tx * e1y - ty * e1x
+            v = (d.dx * qx + d.dy * qy + d.dz * qz) * inv_det
+            t = (e2x * qx + e2y * qy + e2z * qz) * inv_det
+            valid = (det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0) & (t < t_max)
+        if not valid.any():
+            return None
+        t = np.where(valid, t, np.inf)
+        k = int(np.argmin(t))
+        normal = (e1y[k] * e2z[k] - e1z[k] * e2y[k], e1z[k] * e2x[k] - e1x[k] * e2z[k], e1x[k] * e2y[k] - e1y[k] * e2x[k])
+        return (float(t[k]), tuple(float(n) for n in normal))
@@ -0,0 +1,28 @@
+from QuadObj import QuadObj
+from OpenGL.GL import *
+
+class PlaneObj(QuadObj):
+    # How far (in object space) the plane is drawn in the OpenGL preview
+    PREVIEW_EXTENT = 100
+
+    def __init__(self):
+        super().__init__()
+        self.bounded = False
+
+    def render_solid(self, slices=10):
+        """ Draw a large square of the XY plane, facing +z, with the texture repeated every 2 units."""
+        extent = PlaneObj.PREVIEW_EXTENT
+        glMatrixMode(GL_TEXTURE)
+        glPushMatrix()
+        glScalef(extent, extent, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glScalef(extent, extent, 1)
+        self.draw_side(slices, slices)
+        glPopMatrix()
+        glMatrixMode(GL_TEXTURE)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+
+    def local_bounds(self):
+        return None     # Unbounded, never culled by bounds
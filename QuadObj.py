@@ -0,0 +1,60 @@
+from GeomObj import GeomObj
+from Point3 import Point3
+from Vector3 import Vector3
+
+class QuadObj(GeomObj):
+    def __init__(self):
+        super().__init__()
+        self.bounded = True     # PlaneObj turns this off to extend the quad forever
+
+    def render_solid(self, slices=10):
+        """ Draw a 2x2 square centered at origin in the XY plane (coordinates go -1 to 1), facing +z."""
+        self.draw_side(slices, slices)
+
+    def local_bounds(self):
+        return ((-1, -1, 0), (1, 1, 0))
+
+    def local_intersect(self, ray, best_hit):
+        """
+        explanation of logic:
+        the quad lies in the plane z = 0, so with the ray defined by
+          pz = sz + t * dz
+        the plane is hit at
+          t = -sz / dz
+        NOTE: a ray parallel to the plane (dz = 0) never hits it
+
+        the hit point must then fall on [-1, 1] in x and y to be on the quad.
+        the normal is always +z (the side the quad faces), adjusted by the normal map if there is one.
+
+        texture coordinates map the quad onto the full texture:
+          tex_x = px * 1/2 + 1/2      tex_y = py * 1/2 + 1/2
+        """
+        dz = ray.dir.dz
+        if dz == 0:
+            return False
+
+        t = -ray.source.z / dz
+        if t < 0 or (t >= best_hit.t and best_hit.t != -1):
+            return False
+
+        px = ray.source.x + t * ray.dir.dx
+        py = ray.source.y + t * ray.dir.dy
+        if self.bounded and (abs(px) > 1 or abs(py) > 1):
+            return False
+
+        best_hit.t = t
+        best_hit.point = Point3(px, py, 0)     # exactly on the plane, no round off in z
+        best_hit.obj = self
+
+        # texturing, planes repeat the texture every 2 units
+        texture_x = px * 1/2 + 0.5
+        texture_y = py * 1/2 + 0.5
+        if not self.bounded:
+            texture_x %= 1.0
+            texture_y %= 1.0
+        best_hit.texture_color = self.get_texture_pixel_color(texture_x, texture_y)
+
+        # adjust vector for norm based on normal map
+        best_hit.norm = Vector3(0, 0, 1).__add__(self.get_normal_map_pixel_vector(texture_x, texture_y))
+        best_hit.norm.normalize()
+        return True
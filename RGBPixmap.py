@@ -1,26 +1,160 @@
 import pygame
 import numpy as np
+from multiprocessing import shared_memory
 from OpenGL.GL import *
 
 class RGBPixmap:
-    def __init__(self, n_rows, n_cols):
+    """
+    Pixels are stored row by row as pixel[row, col] = (r, g, b), in one of the FORMATS:
+    uint8 (the default, 3 bytes a pixel, ready to save as is), float16 or float32 (for keeping
+    more precision than an image file holds). Colors are written as floats in [0, 1] either way.
+
+    The pixel array normally lives in this process's memory. It can instead live in a shared memory
+    block (shared=True) or a .npy file mapped into memory (filename=...), so several processes can write
+    into the same pixmap in place. A file backed pixmap also keeps images of any size out of memory:
+    finished rows are written back to the file by the OS, and saving reads them straight from it
+    (load(filename) maps the file again later). Pickling a shared or file backed pixmap (e.g. to send
+    it to a worker process) only sends the block or file name, and the copy maps the same memory.
+    The process that created the block owns it and must call close() when done.
+    """
+
+    # Images with more pixels than this (4K) are better rendered into a file (filename=...) than memory
+    MAX_IN_MEMORY_PIXELS = 3840 * 2160
+
+    # Format -> (numpy type, OpenGL type for uploading it as a texture)
+    FORMATS = {
+        'uint8': (np.uint8, GL_UNSIGNED_BYTE),
+        'float16': (np.float16, GL_HALF_FLOAT),
+        'float32': (np.float32, GL_FLOAT),
+    }
+
+    def __init__(self, n_rows, n_cols, shared=False, filename=None, pixel_format='uint8'):
         self.n_rows = n_rows
         self.n_cols = n_cols
-        self.pixel = np.zeros((self.n_cols, self.n_rows, 4), dtype=np.float32)
+        self.pixel_format = pixel_format
+        self.dtype = RGBPixmap.FORMATS[pixel_format][0]
+        self.shm = None         # SharedMemory block holding the pixels, if shared
+        self.owner = True       # Only the creator unlinks the block or file
+        self.filename = filename
+        if shared:
+            self.shm = shared_memory.SharedMemory(create=True, size=RGBPixmap.nbytes(n_rows, n_cols, pixel_format))
+            self.pixel = np.ndarray((self.n_rows, self.n_cols, 3), dtype=self.dtype, buffer=self.shm.buf)
+            self.pixel[:] = 0
+        elif filename is not None:
+            self.pixel = np.lib.format.open_memmap(filename, mode='w+', dtype=self.dtype, shape=(self.n_rows, self.n_cols, 3))
+        else:
+            self.pixel = np.zeros((self.n_rows, self.n_cols, 3), dtype=self.dtype)
+
+    @staticmethod
+    def nbytes(n_rows, n_cols, pixel_format='uint8'):
+        return n_rows * n_cols * 3 * np.dtype(RGBPixmap.FORMATS[pixel_format][0]).itemsize
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.shm is not None:
+            state['shm'] = self.shm.name
+            del state['pixel']
+        elif self.filename is not None:
+            del state['pixel']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.owner = False
+        if self.shm is not None:
+            self.shm = RGBPixmap.attach(self.shm)
+            self.pixel = np.ndarray((self.n_rows, self.n_cols, 3), dtype=self.dtype, buffer=self.shm.buf)
+        elif self.filename is not None:
+            self.pixel = np.load(self.filename, mmap_mode='r+')
+
+    # Map a pixmap saved in a .npy file (e.g. by a file backed render) without reading it in
+    @staticmethod
+    def load(filename):
+        pixmap = RGBPixmap.__new__(RGBPixmap)
+        pixmap.pixel = np.load(filename, mmap_mode='r+')
+        (pixmap.n_rows, pixmap.n_cols) = pixmap.pixel.shape[:2]
+        pixmap.pixel_format = pixmap.pixel.dtype.name   # One of the FORMATS
+        pixmap.dtype = RGBPixmap.FORMATS[pixmap.pixel_format][0]
+        pixmap.shm = None
+        pixmap.owner = True
+        pixmap.filename = filename
+        return pixmap
+
+    @staticmethod
+    def attach(name):
+        # Only the owner should clean the block up, so attaching does not register it with the resource tracker
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            return shared_memory.SharedMemory(name=name)    # Before Python 3.13 there is no choice
+
+    """
+    Release the pixels. The owner of a shared block also frees it, other processes just unmap it.
+    """
+    def close(self):
+        if self.shm is not None:
+            self.pixel = None   # The array must go before the buffer it uses can be closed
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+            self.shm = None
+        elif self.filename is not None:
+            self.pixel.flush()
+            self.pixel = None
 
     def resize(self, n_rows, n_cols):
         """ Could resize this more efficiently! Numpy supports resizing I believe but for now creating new array."""
+        self.close()    # A resized pixmap is always private
+        self.filename = None
         self.n_rows = n_rows
         self.n_cols = n_cols
-        self.pixel = np.zeros((self.n_cols, self.n_rows, 4), dtype=np.float32)
+        self.pixel = np.zeros((self.n_rows, self.n_cols, 3), dtype=self.dtype)
+
+    # Colors (anything with r, g, b first, floats in [0, 1]) as an array in this pixmap's format
+    def encode(self, colors):
+        values = np.asarray(colors, dtype=np.float32)[..., :3]
+        if self.dtype == np.uint8:
+            return (np.clip(values, 0.0, 1.0) * 255).astype(np.uint8)
+        return values.astype(self.dtype)
 
     def set_pixel(self, row, col, color, block_size=1):
-        self.pixel[col:col+block_size, row:row+block_size] = color.rgba
+        self.pixel[row:row+block_size, col:col+block_size] = self.encode(color.rgba)
+
+    """
+    Write a row of blocks at once: colors[i] fills the block_size x block_size block at
+    (row, col + i * block_size), blocks running over the edge are cut off.
+    """
+    def set_row(self, row, col, colors, block_size=1):
+        values = self.encode(colors)
+        if block_size > 1:
+            values = np.repeat(values, block_size, axis=0)
+        n = min(len(values), self.n_cols - col)
+        self.pixel[row:row+block_size, col:col+n] = values[:n]
+
+    # Write a block of pixels already in this pixmap's format (e.g. a tile rendered elsewhere) with its top left at (row, col)
+    def set_tile(self, row, col, pixels):
+        self.pixel[row:row+pixels.shape[0], col:col+pixels.shape[1]] = pixels
+
+    def get_tile(self, row_start, row_end, col_start, col_end):
+        return self.pixel[row_start:row_end, col_start:col_end]
+
+    # The pixels as a contiguous (rows, cols, 3) uint8 array: the pixel array itself for uint8 pixmaps, converted otherwise
+    def rgb8(self):
+        if self.dtype == np.uint8:
+            return self.pixel
+        return (np.clip(self.pixel, 0.0, 1.0) * 255).astype(np.uint8)
+
+    # OpenGL (format, type) of the pixel array, for uploading it as a texture (rows of n_cols pixels, 1 byte aligned)
+    def gl_format(self):
+        return (GL_RGB, RGBPixmap.FORMATS[self.pixel_format][1])
+
+    def save(self, filename):
+        # The surface reads the pixels where they are, nothing is copied before the image is encoded
+        pixels = self.rgb8()
+        surface = pygame.image.frombuffer(pixels.data, (self.n_cols, self.n_rows), 'RGB')
+        pygame.image.save(surface, filename)
 
     def copy_to_surface(self, surface):
         """ Copy the current pixel array to the PyGame surface for displaying"""
-        # Convert the array to uint8 for Pygame
-        pixel_array_uint8 = (self.pixel * 255).astype(np.uint8)
-
-        # Create a Pygame surface and fill it with the pixel array
-        pygame.surfarray.blit_array(surface, pixel_array_uint8[:, :, :3])  # Use only RGB values for the surface
+        # Surfaces are indexed [x][y], so this is a transposed view rather than a copy
+        pygame.surfarray.blit_array(surface, self.rgb8().transpose(1, 0, 2))
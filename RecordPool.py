@@ -0,0 +1,78 @@
+import multiprocessing
+from Window import Window
+
+class RecordPool:
+    """
+    Persistent pool of worker processes that ray trace whole recorded frames in parallel.
+
+    Each worker receives a snapshot of the scene once, when the pool starts, and keeps it for every
+    recording after that. A frame is then only a small message (index, state), where state is what
+    main_simple records for each frame (camera, light angle): apply_state(scene, state) poses the
+    worker's snapshot to match before it renders into its own off-screen Window.
+    Frames come back in order as they finish, so they can be written out while later ones still render.
+
+    The snapshot is not updated, so the pool must be closed and recreated if the scene itself changes.
+    """
+
+    def __init__(self, scene, apply_state, width, height, block_size=1, processes=None):
+        self.width = width
+        self.height = height
+        self.block_size = block_size
+        self.processes = processes if processes is not None else multiprocessing.cpu_count()
+        self.cancel_event = multiprocessing.Event()     # Set to make workers abandon the frames of a recording
+        self.pool = multiprocessing.Pool(self.processes, initializer=RecordPool.init_worker,
+                                         initargs=(scene, apply_state, width, height, block_size, self.cancel_event))
+
+    # True if this pool renders frames of the given settings, so it can be reused
+    def matches(self, width, height, block_size):
+        return (self.width, self.height, self.block_size) == (width, height, block_size)
+
+    """
+    Render every state, yielding (index, pixels) in the order of states, where pixels is the
+    frame's RGBPixmap array. Frames are rendered by all workers at once, a frame is yielded as soon
+    as it and all the frames before it are done.
+    Closing the generator early, or cancelled() (checked while waiting) returning True, stops the
+    frames still being rendered; frames stopped part way yield None for pixels.
+    """
+    def render(self, states, cancelled=None):
+        results = self.pool.imap(RecordPool.render_frame, enumerate(states))
+        try:
+            for i in range(len(states)):
+                while True:
+                    try:
+                        result = results.next(timeout=0.1)
+                        break
+                    except multiprocessing.TimeoutError:
+                        if cancelled is not None and cancelled():
+                            self.cancel_event.set()
+                yield result
+        finally:
+            # Abandoned frames stop at their next progress check, wait for them so the next recording starts with idle workers
+            self.cancel_event.set()
+            for result in results:
+                pass
+            self.cancel_event.clear()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    # Worker process side: (scene, apply_state, window, block_size, cancel_event) set up once by init_worker
+    worker = None
+
+    @staticmethod
+    def init_worker(scene, apply_state, width, height, block_size, cancel_event):
+        scene.verbose = False   # Workers rendering at once would interleave their progress reports
+        scene.progress = lambda fraction: not cancel_event.is_set()
+        RecordPool.worker = (scene, apply_state, Window(width, height), block_size, cancel_event)
+
+    @staticmethod
+    def render_frame(message):
+        (index, state) = message
+        (scene, apply_state, window, block_size, cancel_event) = RecordPool.worker
+        if cancel_event.is_set():
+            return (index, None)
+        apply_state(scene, state)
+        if not scene.render_ray_traced(state[0], window, block_size):
+            return (index, None)
+        return (index, window.pixmap.pixel.copy())
@@ -0,0 +1,173 @@
+import os
+import copy
+import time
+import threading
+import collections
+import multiprocessing
+from multiprocessing.connection import Listener, wait
+from RGBPixmap import RGBPixmap
+from TileScheduler import TileScheduler
+
+class RenderCoordinator:
+    """
+    Splits ray traced frames into tiles and farms them out to RenderWorker processes
+    connected over TCP (address = (host, port)) or a Unix socket (address = path).
+
+    Each worker is sent the scene once, when it joins: a snapshot taken when the coordinator is
+    created, so the caller can keep changing its own scene. After that a frame only costs one small
+    ('frame', index, state, ...) message per worker, where state is applied to the worker's copy
+    of the scene by apply_state(scene, state) (as with RecordPool), followed by the tiles themselves.
+
+    Tiles are dealt out round robin, in the order chosen by a TileScheduler (most expensive first),
+    into a queue per worker. A worker that runs out takes the cheapest tiles from the back of the
+    longest other queue (work stealing), so fast workers end up doing more.
+    When a worker dies, the tiles it was working on and the ones still queued for it are handed
+    to the others. Finished tiles are assembled into an RGBPixmap per frame.
+    """
+
+    def __init__(self, scene, apply_state, address=('localhost', 0), authkey=None, tile_size=32, in_flight=2):
+        self.scene = copy.deepcopy(scene)  # Only read (and pickled for joining workers) from now on
+        self.apply_state = apply_state
+        self.authkey = authkey if authkey is not None else os.urandom(16)
+        self.scheduler = TileScheduler(tile_size)
+        self.in_flight = in_flight      # Tiles sent to a worker ahead of its results, hides the round trip
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+        self.workers = []               # Workers in use, see adopt_workers
+        self.joining = []               # Connections accepted since the last adopt_workers
+        self.joining_lock = threading.Lock()
+        self.closed = False
+        self.accept_thread = threading.Thread(target=self.accept_workers, daemon=True)
+        self.accept_thread.start()
+
+    def accept_workers(self):
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                continue    # A failed handshake, or the listener was closed
+            with self.joining_lock:
+                self.joining.append(conn)
+
+    """
+    Start using the workers that connected since the last call, sending each the scene snapshot.
+    """
+    def adopt_workers(self):
+        with self.joining_lock:
+            (joining, self.joining) = (self.joining, [])
+        for conn in joining:
+            try:
+                conn.send(('scene', self.scene, self.apply_state))
+            except OSError:
+                conn.close()
+                continue
+            self.workers.append({'conn': conn, 'queue': collections.deque(), 'busy': {}, 'frame': None})
+            print("Render worker {0} joined".format(len(self.workers)))
+
+    # Block until at least count workers are connected (or timeout seconds pass), returns how many are
+    def wait_for_workers(self, count, timeout=None):
+        start = time.time()
+        while True:
+            self.adopt_workers()
+            if len(self.workers) >= count or (timeout is not None and time.time() - start >= timeout):
+                return len(self.workers)
+            time.sleep(0.05)
+
+    """
+    Render a frame for every state, yielding (index, RGBPixmap) in order.
+    """
+    def render_frames(self, states, width, height, block_size=1):
+        for (index, state) in enumerate(states):
+            yield (index, self.render_frame(index, state, width, height, block_size))
+
+    def render_frame(self, index, state, width, height, block_size=1):
+        tiles = self.scheduler.tiles(width, height, block_size)
+        pixmap = RGBPixmap(height, width)
+        frame_message = ('frame', index, state, width, height, block_size)
+
+        self.adopt_workers()
+        orphans = collections.deque(range(len(tiles)))   # Tiles not queued for any worker
+        for i in range(len(tiles)):
+            if len(self.workers) > 0:
+                self.workers[i % len(self.workers)]['queue'].append(orphans.popleft())
+        done = set()
+        waiting = False
+
+        while len(done) < len(tiles):
+            self.adopt_workers()
+            if len(self.workers) == 0:
+                if not waiting:
+                    print("Waiting for render workers to connect to {0}".format(self.address))
+                    waiting = True
+                time.sleep(0.1)
+                continue
+            waiting = False
+
+            # Keep every worker busy, stealing tiles once its own queue is empty
+            for worker in list(self.workers):
+                while len(worker['busy']) < self.in_flight:
+                    tile_id = self.next_tile(worker, orphans)
+                    if tile_id is None:
+                        break
+                    try:
+                        if worker['frame'] != index:
+                            worker['conn'].send(frame_message)
+                            worker['frame'] = index
+                        worker['conn'].send(('tile', index, tile_id, tiles[tile_id]))
+                    except OSError:
+                        orphans.append(tile_id)
+                        self.drop_worker(worker, orphans)
+                        break
+                    worker['busy'][tile_id] = tiles[tile_id]
+
+            # Collect finished tiles
+            by_conn = {worker['conn']: worker for worker in self.workers}
+            for conn in wait(list(by_conn), timeout=0.5):
+                worker = by_conn[conn]
+                try:
+                    (kind, frame, tile_id, pixels, seconds) = conn.recv()
+                except (EOFError, OSError):
+                    self.drop_worker(worker, orphans)
+                    continue
+                if frame != index or tile_id not in worker['busy']:
+                    continue
+                (r0, r1, c0, c1) = worker['busy'].pop(tile_id)
+                if tile_id not in done:
+                    pixmap.set_tile(r0, c0, pixels)
+                    self.scheduler.record(tiles[tile_id], seconds)
+                    done.add(tile_id)
+        return pixmap
+
+    # The next tile for worker: from its own queue, then orphaned tiles, then stolen from the longest other queue
+    def next_tile(self, worker, orphans):
+        if worker['queue']:
+            return worker['queue'].popleft()
+        if orphans:
+            return orphans.popleft()
+        victim = max(self.workers, key=lambda other: len(other['queue']))
+        if victim['queue']:
+            return victim['queue'].pop()
+        return None
+
+    def drop_worker(self, worker, orphans):
+        # Everything the worker had is handed back to the others
+        orphans.extend(worker['busy'])
+        orphans.extend(worker['queue'])
+        self.workers.remove(worker)
+        worker['conn'].close()
+        print("Render worker lost, re-dispatching {0} tiles".format(len(worker['busy']) + len(worker['queue'])))
+
+    def close(self):
+        self.closed = True
+        with self.joining_lock:
+            for conn in self.joining:
+                conn.close()
+            self.joining = []
+        for worker in self.workers:
+            try:
+                worker['conn'].send(('stop',))
+            except OSError:
+                pass
+            worker['conn'].close()
+        self.workers = []
+        self.listener.close()
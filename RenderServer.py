@@ -0,0 +1,405 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import importlib
+import functools
+import itertools
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from Camera import Camera
+from Point3 import Point3
+from Vector3 import Vector3
+from Window import Window
+from RGBPixmap import RGBPixmap
+from TilePool import TilePool
+from BackgroundRenderer import RenderJob
+
+class ServerJob(RenderJob):
+    """
+    RenderJob submitted to a RenderServer, with the request it came from and the
+    connections watching it (each one an asyncio.Queue of events to send back).
+    """
+
+    def __init__(self, job_id, request, priority=0):
+        super().__init__("Job {0}".format(job_id), len(request['frames']))
+        self.id = job_id
+        self.request = request
+        self.priority = priority
+        self.watchers = []
+        self.sequence = 0       # Order it was submitted in, breaks ties between equal priorities
+        self.state = 'queued'   # queued, running, done, cancelled or error
+
+class RenderServer:
+    """
+    Long running local process that ray traces jobs sent to it over a Unix socket (address = path)
+    or localhost TCP (address = (host, port)), keeping scenes, decoded textures and worker pools
+    warm between jobs, so a job starts rendering straight away.
+
+    The protocol is one JSON object per line (not HTTP: events for a job stream back on the connection
+    that submitted or watches it, which plain newline separated JSON does without a web framework). Requests:
+      {"op": "submit", "scene": "main_simple", "frames": [{"eye": [0, 0, 10], "look": [0, 0, 0], "up": [0, 1, 0], "light_angle": 0}, ...],
+       "width": 500, "height": 500, "block_size": 1, "max_reflection_depth": 3, "specular_lut_size": 0,
+       "view_angle": 45, "priority": 0, "output": "job{job}_frame{frame:04}.png"}
+      {"op": "status"}
+      {"op": "cancel", "job": id}
+      {"op": "watch", "job": id}
+    Everything in a submit but "frames" is optional; frames leave out what should come from the scene's
+    own camera. Jobs with a higher priority run first, jobs of equal priority in the order they came.
+    Events sent back, each with the "job" it is about:
+      queued (with its place in the queue), started, progress (frame and fraction of the job done, a few
+      times a second), frame (path of each image saved), then one of done (all the output paths),
+      cancelled or error (message).
+    The connection that submitted a job gets its events, as does any that watches it. Finished jobs
+    are remembered (the last MAX_FINISHED_JOBS of them), so watching one sends its final event and outputs.
+
+    A scene is a module with a build_scene() function returning (scene, apply_state, camera), as in
+    main_simple; it is imported and built once, on the first job that uses it. With processes > 1,
+    frames are ray traced by a TilePool kept for each scene and image size (only the MAX_TILE_POOLS
+    most recently used, older ones are closed), otherwise on the server's render thread (with
+    render_threads threads, see Scene.render_threads).
+    """
+
+    def __init__(self, address, processes=1, render_threads=0, output_dir='.'):
+        self.address = address
+        self.processes = processes
+        self.render_threads = render_threads
+        self.output_dir = output_dir
+        self.jobs = {}                  # id -> ServerJob, for status, cancel and watch
+        self.finished = collections.deque()     # Ids of finished jobs still in jobs, oldest first
+        self.queue = None               # asyncio.PriorityQueue of (-priority, sequence, job), made in serve
+        self.sequence = itertools.count()
+        self.job_ids = itertools.count(1)
+        self.current = None
+        self.loop = None
+        # Used only from the render thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.scenes = {}                # Module name -> (scene, apply_state, camera, its own quality settings)
+        self.tile_pools = collections.OrderedDict()     # (module name, width, height) -> TilePool, least recently used first
+        self.windows = collections.OrderedDict()        # (module name, width, height) -> Window, for rendering without a pool
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.PriorityQueue()
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.remove(self.address)     # Left over from a server that did not shut down
+            server = await asyncio.start_unix_server(self.handle_client, self.address, limit=2 ** 24)
+        else:
+            server = await asyncio.start_server(self.handle_client, self.address[0], self.address[1], limit=2 ** 24)
+            self.address = server.sockets[0].getsockname()[:2]
+        print("Render server listening on {0}".format(self.address))
+        runner = asyncio.create_task(self.run_jobs())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            runner.cancel()
+            if self.current is not None:
+                self.current.cancel()
+            self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for pool in self.tile_pools.values():
+            pool.close()
+        self.tile_pools.clear()
+        for window in self.windows.values():
+            window.pixmap.close()
+        self.windows.clear()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    async def handle_client(self, reader, writer):
+        outbox = asyncio.Queue()
+        sender = asyncio.create_task(self.send_events(outbox, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    self.handle_request(request, outbox)
+                except (ValueError, KeyError, TypeError) as error:
+                    outbox.put_nowait({'job': None, 'event': 'error', 'message': "Bad request: {0}".format(error)})
+        finally:
+            for job in self.jobs.values():
+                if outbox in job.watchers:
+                    job.watchers.remove(outbox)
+            outbox.put_nowait(None)
+            await sender
+
+    async def send_events(self, outbox, writer):
+        try:
+            while True:
+                event = await outbox.get()
+                if event is None:
+                    break
+                writer.write((json.dumps(event) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass    # Client went away, its jobs keep going
+        writer.close()
+
+    def handle_request(self, request, outbox):
+        op = request.get('op')
+        if op == 'submit':
+            RenderServer.check_submit(request)     # Before the job is registered, so a bad request leaves nothing behind
+            job = ServerJob(next(self.job_ids), request, request.get('priority', 0))
+            job.sequence = next(self.sequence)
+            job.watchers.append(outbox)
+            self.jobs[job.id] = job
+            self.queue.put_nowait((-job.priority, job.sequence, job))
+            self.publish(job, event='queued', position=self.queued_jobs().index(job) + 1)
+        elif op == 'status':
+            outbox.put_nowait({'job': None, 'event': 'status',
+                               'running': None if self.current is None else self.current.id,
+                               'progress': None if self.current is None else self.current.progress(),
+                               'queued': [job.id for job in self.queued_jobs()]})
+        elif op == 'cancel':
+            job = self.jobs[request['job']]
+            job.cancel()
+            if job.state == 'queued':
+                self.finish(job, 'cancelled')   # Dropped when it reaches the front of the queue
+        elif op == 'watch':
+            job = self.jobs[request['job']]
+            job.watchers.append(outbox)
+            outbox.put_nowait({'job': job.id, 'event': job.state, 'progress': job.progress(), 'outputs': job.outputs})
+        else:
+            raise ValueError("unknown op {0!r}".format(op))
+
+    @staticmethod
+    def check_submit(request):
+        frames = request.get('frames')
+        if not isinstance(frames, list) or not frames or not all(isinstance(frame, dict) for frame in frames):
+            raise ValueError("frames must be a non-empty list of objects")
+        for frame in frames:
+            for point in ('eye', 'look', 'up'):
+                if point in frame and (not isinstance(frame[point], list) or len(frame[point]) != 3
+                                       or not all(RenderServer.is_number(value) for value in frame[point])):
+                    raise ValueError("{0} must be a list of 3 numbers".format(point))
+            if 'light_angle' in frame and not RenderServer.is_number(frame['light_angle']):
+                raise TypeError("light_angle must be a number")
+        for setting in ('priority', 'view_angle'):
+            if setting in request and not RenderServer.is_number(request[setting]):
+                raise TypeError("{0} must be a number".format(setting))
+        for setting in ('width', 'height', 'block_size'):
+            value = request.get(setting, 1)
+            if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                raise ValueError("{0} must be a positive integer".format(setting))
+
+    @staticmethod
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    # Jobs waiting to run, in the order they will run
+    def queued_jobs(self):
+        return sorted((job for job in self.jobs.values() if job.state == 'queued'), key=lambda job: (-job.priority, job.sequence))
+
+    def publish(self, job, **event):
+        event['job'] = job.id
+        for outbox in job.watchers:
+            outbox.put_nowait(event)
+
+    def finish(self, job, state, **event):
+        job.state = state
+        self.publish(job, event=state, **event)
+        job.done_event.set()
+        self.finished.append(job.id)
+        while len(self.finished) > RenderServer.MAX_FINISHED_JOBS:
+            del self.jobs[self.finished.popleft()]
+
+    # Take jobs off the queue one at a time and render them on the render thread
+    async def run_jobs(self):
+        while True:
+            (priority, sequence, job) = await self.queue.get()
+            if job.state != 'queued':
+                continue    # Cancelled while it waited
+            self.current = job
+            job.state = 'running'
+            self.publish(job, event='started')
+            start = time.perf_counter()
+            try:
+                await self.loop.run_in_executor(self.executor, self.render_job, job)
+            except Exception as error:
+                self.finish(job, 'error', message=repr(error))
+            else:
+                if job.cancelled():
+                    self.finish(job, 'cancelled', outputs=job.outputs)
+                else:
+                    self.finish(job, 'done', outputs=job.outputs, seconds=time.perf_counter() - start)
+            self.current = None
+
+    # Called from the render thread, hands the event to the event loop
+    def publish_threadsafe(self, job, **event):
+        self.loop.call_soon_threadsafe(functools.partial(self.publish, job, **event))
+
+    """
+    Render thread side: ray trace each frame of a job with the warm scene (and pool),
+    saving it as soon as it is done.
+    """
+    def render_job(self, job):
+        request = job.request
+        name = request.get('scene', 'main_simple')
+        (scene, apply_state, camera, defaults) = self.get_scene(name)
+        width = request.get('width', 500)
+        height = request.get('height', 500)
+        block_size = request.get('block_size', 1)
+        quality = {setting: request[setting] for setting in RenderServer.QUALITY_SETTINGS if setting in request}
+        output = request.get('output', 'job{job}_frame{frame:04}.png')
+        pool = self.get_tile_pool(name, width, height) if self.processes > 1 else None
+        window = self.get_window(name, width, height) if pool is None else None
+        last_report = [0.0]
+
+        def progress(fraction, index):
+            # Progress goes out a few times a second, however often the renderer reports it
+            if not job.update(fraction, index):
+                return False
+            now = time.perf_counter()
+            if now - last_report[0] >= RenderServer.PROGRESS_INTERVAL:
+                last_report[0] = now
+                self.publish_threadsafe(job, event='progress', frame=index, progress=job.progress())
+            return True
+
+        for (index, frame) in enumerate(request['frames']):
+            state = (self.frame_camera(camera, frame, request, width, height), frame.get('light_angle', 0), quality)
+            if pool is not None:
+                pixmap = pool.render(state, block_size, progress=lambda fraction, index=index: progress(fraction, index))
+                if pixmap is None:
+                    return
+            else:
+                RenderServer.apply_job_state(apply_state, defaults, scene, state)
+                scene.progress = lambda fraction, index=index: progress(fraction, index)
+                if not scene.render_ray_traced(state[0], window, block_size):
+                    return
+                pixmap = window.pixmap
+            filename = os.path.abspath(os.path.join(self.output_dir, output.format(job=job.id, frame=index + 1)))
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            pixmap.save(filename)
+            job.outputs.append(filename)
+            job.update(0.0, index + 1)
+            self.publish_threadsafe(job, event='frame', frame=index, path=filename, progress=job.progress())
+
+    # Scene attributes a job may set, a job that leaves one out gets the scene's own value
+    QUALITY_SETTINGS = ('max_reflection_depth', 'specular_lut_size', 'reflective_coeff_cutoff')
+    PROGRESS_INTERVAL = 0.25
+    MAX_TILE_POOLS = 2          # Each one is processes worker processes plus a shared pixmap
+    MAX_WINDOWS = 2
+    MAX_FINISHED_JOBS = 100
+
+    """
+    Pose a scene for a frame (camera, light angle, quality settings): the quality settings are set on the
+    scene, then the rest is posed by the scene's own apply_state. Bound to apply_state and the scene's
+    defaults with functools.partial so it can be handed to worker processes.
+    """
+    @staticmethod
+    def apply_job_state(apply_state, defaults, scene, state):
+        for setting in RenderServer.QUALITY_SETTINGS:
+            setattr(scene, setting, state[2].get(setting, defaults[setting]))
+        apply_state(scene, state)
+
+    # Camera for a frame of a job: the scene's camera, with whatever the frame gives replaced
+    @staticmethod
+    def frame_camera(camera, frame, request, width, height):
+        eye = Point3(*frame['eye']) if 'eye' in frame else Point3(camera.eye.x, camera.eye.y, camera.eye.z)
+        look = Point3(*frame['look']) if 'look' in frame else Point3(camera.look.x, camera.look.y, camera.look.z)
+        up = Vector3(*frame['up']) if 'up' in frame else Vector3(camera.up.dx, camera.up.dy, camera.up.dz)
+        result = Camera(eye, look, up)
+        result.set_lens_shape(request.get('view_angle', camera.angle), width / height, camera.near_dist, camera.far_dist)
+        return result
+
+    def get_scene(self, name):
+        if name not in self.scenes:
+            print("Building scene {0}".format(name))
+            (scene, apply_state, camera) = importlib.import_module(name).build_scene()
+            scene.verbose = False
+            scene.render_threads = self.render_threads
+            scene.freeze()
+            defaults = {setting: getattr(scene, setting) for setting in RenderServer.QUALITY_SETTINGS}
+            self.scenes[name] = (scene, apply_state, camera, defaults)
+        return self.scenes[name]
+
+    # Images too big for memory are rendered into a .npy file in the output directory, one per scene and size
+    def render_file(self, name, width, height):
+        if width * height > RGBPixmap.MAX_IN_MEMORY_PIXELS:
+            return os.path.join(self.output_dir, 'render_{0}_{1}x{2}.npy'.format(name, width, height))
+        return None
+
+    """
+    Windows and tile pools are kept for the most recently used scenes and sizes. They are only used on the
+    render thread, one job at a time, so the least recently used one can be closed when a new one is needed.
+    """
+    def get_window(self, name, width, height):
+        key = (name, width, height)
+        if key not in self.windows:
+            if len(self.windows) >= RenderServer.MAX_WINDOWS:
+                self.windows.popitem(last=False)[1].pixmap.close()
+            filename = self.render_file(name, width, height)
+            pixmap = None if filename is None else RGBPixmap(height, width, filename=filename)
+            self.windows[key] = Window(width, height, pixmap=pixmap)
+        self.windows.move_to_end(key)
+        return self.windows[key]
+
+    def get_tile_pool(self, name, width, height):
+        key = (name, width, height)
+        if key not in self.tile_pools:
+            if len(self.tile_pools) >= RenderServer.MAX_TILE_POOLS:
+                ((old_name, old_width, old_height), pool) = self.tile_pools.popitem(last=False)
+                print("Closing the worker processes for {0} at {1}x{2}".format(old_name, old_width, old_height))
+                pool.close()
+            (scene, apply_state, camera, defaults) = self.get_scene(name)
+            print("Starting {0} worker processes for {1} at {2}x{3}".format(self.processes, name, width, height))
+            self.tile_pools[key] = TilePool(scene, functools.partial(RenderServer.apply_job_state, apply_state, defaults),
+                                            width, height, self.processes, filename=self.render_file(name, width, height))
+        self.tile_pools.move_to_end(key)
+        return self.tile_pools[key]
+
+    """
+    Client side: send a job to the server at address and yield its events as they arrive,
+    up to and including the last one (done, cancelled or error).
+    """
+    @staticmethod
+    def submit(address, request):
+        if isinstance(address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        with sock:
+            sock.connect(address)
+            sock.sendall((json.dumps(dict(request, op='submit')) + '\n').encode())
+            with sock.makefile('r') as lines:
+                for line in lines:
+                    event = json.loads(line)
+                    yield event
+                    if event['event'] in ('done', 'cancelled', 'error'):
+                        break
+
+if __name__ == "__main__":
+    # python RenderServer.py [host port | socket_path]
+    #   starts a server (with a worker process per CPU core), and with "submit" before the address sends it the job in a JSON file:
+    # python RenderServer.py submit (host port | socket_path) job.json
+    args = sys.argv[1:]
+    submitting = len(args) > 0 and args[0] == 'submit'
+    if submitting:
+        args = args[1:]
+    if len(args) >= 2 and args[1].isdigit():
+        address = (args[0], int(args[1]))
+        args = args[2:]
+    elif len(args) >= 1:
+        address = args[0]
+        args = args[1:]
+    else:
+        address = ('localhost', 8345)
+    if submitting:
+        with open(args[0]) as file:
+            request = json.load(file)
+        for event in RenderServer.submit(address, request):
+            print(json.dumps(event))
+    else:
+        try:
+            asyncio.run(RenderServer(address, os.cpu_count()).serve())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,91 @@
+import sys
+import time
+import pickle
+import multiprocessing
+from multiprocessing.connection import Client
+from Window import Window
+
+class RenderWorker:
+    """
+    Worker side of RenderCoordinator: connects to the coordinator, receives the scene once,
+    then renders the tiles it is sent and sends each one back as soon as it is done.
+
+    Messages from the coordinator:
+      ('scene', scene, apply_state)                          the scene to render from now on
+      ('frame', index, state, width, height, block_size)     pose the scene for the tiles that follow
+      ('tile', index, tile_id, (row_start, row_end, col_start, col_end))
+      ('stop',)
+    Every tile is answered with ('tile', index, tile_id, pixels, seconds it took).
+
+    Run one on any machine that can reach the coordinator with
+      python RenderWorker.py host port key        (TCP)
+      python RenderWorker.py path key             (Unix socket)
+    where key is the coordinator's authkey in hex.
+    """
+
+    def __init__(self, address, authkey):
+        self.conn = Client(address, authkey=authkey)
+        self.scene = None
+        self.apply_state = None
+        self.window = None
+        self.frame = None
+
+    def run(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break   # Coordinator went away
+            except (pickle.UnpicklingError, AttributeError, ImportError) as error:
+                # E.g. the scene or apply_state uses a module this machine does not have
+                print("Render worker could not load a message from the coordinator: {0!r}".format(error))
+                break
+            kind = message[0]
+            if kind == 'scene':
+                (kind, self.scene, self.apply_state) = message
+                self.scene.verbose = False
+                self.frame = None
+            elif kind == 'frame':
+                (kind, index, state, width, height, block_size) = message
+                if self.frame is not None:
+                    self.scene.end_frame()
+                self.apply_state(self.scene, state)
+                if self.window is None or (self.window.width, self.window.height) != (width, height):
+                    self.window = Window(width, height)
+                self.scene.begin_frame(state[0], width, height, block_size)
+                self.frame = index
+            elif kind == 'tile':
+                (kind, index, tile_id, (r0, r1, c0, c1)) = message
+                start = time.perf_counter()
+                self.scene.render_tile(self.window, r0, r1, c0, c1)
+                seconds = time.perf_counter() - start
+                self.conn.send(('tile', index, tile_id, self.window.pixmap.get_tile(r0, r1, c0, c1).copy(), seconds))
+            elif kind == 'stop':
+                break
+        self.conn.close()
+
+    @staticmethod
+    def run_worker(address, authkey):
+        RenderWorker(address, authkey).run()
+
+    """
+    Start count worker processes on this machine, connected to the coordinator at address.
+    """
+    @staticmethod
+    def spawn_local(address, authkey, count):
+        processes = []
+        for i in range(count):
+            process = multiprocessing.Process(target=RenderWorker.run_worker, args=(address, authkey), daemon=True)
+            process.start()
+            processes.append(process)
+        return processes
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4:
+        address = (sys.argv[1], int(sys.argv[2]))
+    elif len(sys.argv) == 3:
+        address = sys.argv[1]
+    else:
+        print("Usage: python RenderWorker.py host port key  or  python RenderWorker.py socket_path key")
+        sys.exit(1)
+    RenderWorker.run_worker(address, bytes.fromhex(sys.argv[-1]))
@@ -1,10 +1,15 @@
 import math
-from GeomObj import GeomObj
+import time
+from GeomObj import GeomObj, all_bound_counts, all_bound_counts_lock
 from Light import Light
 from Hit import Hit
 from Ray import Ray
 from Color import Color
 from Vector3 import Vector3
+from ScreenBins import ScreenBins
+from BVH import BVH
+from TileScheduler import TileScheduler
+from concurrent.futures import ThreadPoolExecutor
 from OpenGL.GL import *
 
 class Scene:
@@ -15,13 +20,122 @@ class Scene:
         self.reflection_adjustment = 0.01
         self.max_reflection_depth = 3
         self.reflective_coeff_cutoff = 0.05
+        self.screen_bins = ScreenBins(tile_size=32)  # Per-tile object lists for primary rays
+        self.bvh = BVH()                             # Hierarchy over all objects for every other ray
+        self.shading_tables = {}    # Material -> light-independent color and per-light coefficients (see prepare_shading)
+        self.specular_lut_size = 0  # Samples in the specular power lookup tables, 0 uses math.pow
+        self.specular_luts = {}     # Shininess -> phong**shininess sampled over [0, 1]
+        self.verbose = True         # Print progress and statistics while ray tracing
+        self.frame = None           # Per-frame constants between begin_frame and end_frame
+        self.global_ambient = tuple(Light.get_global_ambient().rgba)
+        self.render_threads = 0     # Threads ray tracing tiles in render_ray_traced, 0 or 1 renders on the calling thread
+        self.thread_pool = None     # ThreadPoolExecutor kept between frames
+        self.thread_pool_size = 0
+        self.tile_scheduler = TileScheduler()
+        self.progress = None        # Called with the fraction of the frame done while ray tracing, returning False stops the frame
+
+    # Copies (for other processes or background renders) start their own thread pool, without the progress callback
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['thread_pool'] = None
+        state['thread_pool_size'] = 0
+        state['progress'] = None
+        return state
 
     def add_object(self, obj):
         self.objects.append(obj)
 
+    """
+    * freeze:
+    *     Precompiles the per-object intersection constants (see GeomObj.freeze) before rendering.
+    *     Only objects edited since they were last frozen are recomputed, so this is cheap to call every frame.
+    *     Objects edited after freezing re-freeze themselves on their next intersection test.
+    *     The BVH is then refit around the objects that moved (or rebuilt if needed),
+    *     and the global ambient light is snapshot again (see prepare_shading), so a frozen scene describes what is rendered.
+    """
+    def freeze(self):
+        self.global_ambient = tuple(Light.get_global_ambient().rgba)
+        for obj in self.objects:
+            if not obj.frozen:
+                obj.freeze()
+        self.bvh.update(self.objects)
+
     def add_light(self, light):
         self.lights.append(light)
 
+    """
+    * prepare_origins:
+    *     Caches each object's object-space copy of source (and its origin-only intersection terms).
+    *     Called once per frame with the camera eye, since every primary ray starts there.
+    *     Passing None clears the caches again.
+    """
+    def prepare_origins(self, source):
+        for obj in self.objects:
+            obj.prepare_origin(source)
+
+    """
+    * report_bound_rejections:
+    *     Prints how many object tests were rejected by the bounding sphere check in GeomObj.intersect, then resets the counters.
+    *     The counters are kept per thread (see bound_counts in GeomObj.py) and summed here, once the frame's threads are done.
+    """
+    def report_bound_rejections(self):
+        with all_bound_counts_lock:
+            tests = sum(counts[0] for counts in all_bound_counts)
+            rejects = sum(counts[1] for counts in all_bound_counts)
+            for counts in all_bound_counts:
+                counts[:] = [0, 0]
+        if tests > 0 and self.verbose:
+            print("Bounding sphere rejections: {0} of {1} tests ({2:.1f}%)".format(rejects, tests, 100 * rejects / tests))
+
+    """
+    * prepare_shading:
+    *     Precomputes the products of light and material colors used by shade, once per frame instead of per hit.
+    *     For every material in the scene the table holds
+    *         base:   emissive + global ambient * ambient + the ambient of every light * ambient (rgba)
+    *         lights: (light, diffuse * diffuse, specular * specular, specular power table or None) for each light
+    *     Must be called again after changing lights or materials, render_ray_traced does so every frame.
+    *     With specular_lut_size > 0, phong**shininess is looked up (and interpolated) instead of calling math.pow.
+    """
+    def prepare_shading(self):
+        self.shading_tables = {}
+        self.specular_luts = {}
+        self.global_ambient = tuple(Light.get_global_ambient().rgba)    # Snapshot, render threads never read the shared Color
+        for obj in self.objects:
+            if not obj.frozen:
+                obj.freeze()
+            if obj.frozen_material not in self.shading_tables:
+                self.shading_tables[obj.frozen_material] = self.build_shading(obj.frozen_material)
+
+    def build_shading(self, mat):
+        ambient = mat.get_ambient().rgba
+        emissive = mat.get_emissive().rgba
+        global_ambient = self.global_ambient
+        base = [emissive[i] + global_ambient[i] * ambient[i] for i in range(3)]
+        lights = []
+        for light in self.lights:
+            light_ambient = light.get_ambient().rgba
+            light_diffuse = light.get_diffuse().rgba
+            light_specular = light.get_specular().rgba
+            mat_diffuse = mat.get_diffuse().rgba
+            mat_specular = mat.get_specular().rgba
+            for i in range(3):
+                base[i] += light_ambient[i] * ambient[i]
+            lights.append((
+                light,
+                tuple(light_diffuse[i] * mat_diffuse[i] for i in range(3)),
+                tuple(light_specular[i] * mat_specular[i] for i in range(3)),
+                self.specular_lut(mat.get_shininess())
+            ))
+        return ((base[0], base[1], base[2], emissive[3]), lights)
+
+    def specular_lut(self, shininess):
+        if self.specular_lut_size <= 0:
+            return None
+        if shininess not in self.specular_luts:
+            n = self.specular_lut_size
+            self.specular_luts[shininess] = [math.pow(i / n, shininess) for i in range(n + 1)] + [1.0]  # padded for phong == 1
+        return self.specular_luts[shininess]
+
     def render_solid(self, camera, window):
         glEnable(GL_DEPTH_TEST)
 
@@ -43,44 +157,134 @@ class Scene:
             obj.done_solid()
         glFlush()
 
+    """
+    * render_ray_traced:
+    *     Ray traces the view of camera into window's pixmap.
+    *     Returns False if the frame was stopped early by the progress callback (see self.progress), True otherwise.
+    """
     def render_ray_traced(self, camera, window, block_size=1):
         width, height = window.width, window.height
-        total_blocks = (width // block_size) * (height // block_size)
-        completed_blocks = 0
+        self.begin_frame(camera, width, height, block_size)
+        if self.render_threads > 1:
+            finished = self.render_tiles_threaded(window, width, height, block_size)
+        else:
+            finished = True
+            next_prog_report = 0
+            for row in range(0, height, block_size):
+                self.render_tile(window, row, row + block_size, 0, width)
+                progress = min(row + block_size, height) / height * 100
+                if progress >= next_prog_report and self.verbose:
+                    print(f"Ray tracing progress: {progress:.2f}%")
+                    next_prog_report += 10
+                if not self.report_progress(progress / 100):
+                    finished = False
+                    break
+        self.end_frame()
+        return finished
+
+    # Pass the fraction of the frame done so far to the progress callback, False means stop
+    def report_progress(self, fraction):
+        return self.progress is None or self.progress(fraction) is not False
+
+    """
+    * render_tiles_threaded:
+    *     Ray traces the frame started by begin_frame as tiles on a pool of render_threads threads, in tile_scheduler order.
+    *     Threads share the scene without copying it, which scales across cores on free-threaded Python builds.
+    *     Shared state is only read during a frame: every material's shading table is built by prepare_shading (see also
+    *     GeomObj.freeze) before the threads start, and the bounding sphere counters each thread bumps are its own.
+    *     Threads write nothing else but their rays' Hits and their tiles' pixels.
+    """
+    def render_tiles_threaded(self, window, width, height, block_size):
+        if self.thread_pool is None or self.thread_pool_size != self.render_threads:
+            if self.thread_pool is not None:
+                self.thread_pool.shutdown()
+            self.thread_pool = ThreadPoolExecutor(max_workers=self.render_threads)
+            self.thread_pool_size = self.render_threads
+
+        def render(tile):
+            start = time.perf_counter()
+            self.render_tile(window, tile[0], tile[1], tile[2], tile[3])
+            return (tile, time.perf_counter() - start)
+
+        tiles = self.tile_scheduler.tiles(width, height, block_size)
+        futures = [self.thread_pool.submit(render, tile) for tile in tiles]   # Started in schedule order
+        next_prog_report = 0
+        for (completed, future) in enumerate(futures, 1):
+            (tile, seconds) = future.result()
+            self.tile_scheduler.record(tile, seconds)
+            progress = completed / len(tiles) * 100
+            if progress >= next_prog_report and self.verbose:
+                print(f"Ray tracing progress: {progress:.2f}%")
+                next_prog_report += 10
+            if not self.report_progress(progress / 100):
+                # Drop the tiles not started yet and let the running ones finish before end_frame clears the caches
+                for other in futures:
+                    other.cancel()
+                for other in futures:
+                    if not other.cancelled():
+                        other.result()
+                return False
+        return True
+
+    """
+    * begin_frame / render_tile / end_frame:
+    *     render_ray_traced split into steps, so parts of a frame can be rendered separately (e.g. by workers, see RenderCoordinator).
+    *     begin_frame prepares the scene for a frame of width x height seen by camera, render_tile then ray traces
+    *     rows [row_start, row_end) and columns [col_start, col_end) into window (tile edges should be multiples of block_size),
+    *     and end_frame clears the per-frame caches again.
+    """
+    def begin_frame(self, camera, width, height, block_size=1):
+        self.freeze()
+        self.prepare_shading()
+        self.prepare_origins(camera.eye)
+        bins = self.screen_bins
+        bins.build(self.objects, camera, width, height)
 
         N = camera.near_dist
         H = N * math.tan(math.radians(camera.angle/2))
         W = H * camera.aspect_ratio
         deltaC = 2*W/width * block_size
         deltaR = 2*H/height * block_size
+        self.frame = (camera, block_size, N, H, W, deltaC, deltaR)
+
+        if self.verbose:
+            print("Camera: eye={0}, u={1}, v={2}, n={3}".format(camera.eye, camera.u, camera.v, camera.n))
+            print("Screen bins: {0:.1f} of {1} objects per tile on average".format(bins.average_candidates(), len(self.objects)))
+            print("BVH: {0}".format(self.bvh.last_update))
+
+    def render_tile(self, window, row_start, row_end, col_start, col_end):
+        (camera, block_size, N, H, W, deltaC, deltaR) = self.frame
+        bins = self.screen_bins
         ray = Ray(camera.eye, camera.n.__mul__(-1))
 
-        next_prog_report = 0
-        print("Camera: eye={0}, u={1}, v={2}, n={3}".format(camera.eye, camera.u, camera.v, camera.n))
-        vr = H
-        for row in range(0, height, block_size): 
-            uc = -W
-            for col in range(0, width, block_size):
+        # uc and vr are computed from the block index (not accumulated), so a pixel comes out the same in any tiling
+        for row in range(row_start, row_end, block_size):
+            vr = H - (row // block_size) * deltaR
+            colors = []     # Written to the pixmap a whole row of the tile at a time
+            for col in range(col_start, col_end, block_size):
+                uc = -W + (col // block_size) * deltaC
                 # Create ray
                 ray.dir = camera.n.__mul__(-N)
                 ray.dir.add(camera.u.__mul__(uc))
                 ray.dir.add(camera.v.__mul__(vr))
 
-                # Compute ray intersection with scene
-                temp_color = self.shade(ray)
+                # Compute ray intersection with scene (primary rays only test the objects binned to their tile)
+                temp_color = self.shade(ray, objects=bins.candidates(row, col))
                 temp_color.cap() # Make sure no value is >1
-                window.draw_pixel(row, col, temp_color, block_size)
+                colors.append(temp_color.rgba)
+            window.draw_row(row, col_start, colors, block_size)
 
-                completed_blocks += 1
-                progress = (completed_blocks / total_blocks) * 100
-                if progress >= next_prog_report:
-                    print(f"Ray tracing progress: {progress:.2f}%")
-                    next_prog_report += 10
-                uc += deltaC
-            vr -= deltaR
-            
-    def intersect(self, ray, best_hit, skip_translucent=False, just_one=False, ignore=[]):
-        for obj in self.objects:
+    def end_frame(self):
+        self.frame = None
+        self.prepare_origins(None)  # camera.eye may move in place before the next frame
+        self.report_bound_rejections()
+
+    def intersect(self, ray, best_hit, skip_translucent=False, just_one=False, ignore=(), objects=None):
+        if objects is None:
+            if self.frame is None:
+                self.freeze()   # Not rendering a frame (e.g. called directly), so the BVH may not cover the latest objects
+            return self.bvh.intersect(ray, best_hit, skip_translucent, just_one, ignore)
+        for obj in objects:
             if obj not in ignore and (not skip_translucent or not obj.material.is_translucent()):
                 if obj.intersect(ray, best_hit) and just_one:
                     return True  # Stop the moment we find ANY intersection (for shadows)
@@ -92,71 +296,77 @@ class Scene:
     *     reflectiveCoefficient: a much better means of cutting off reflection recursion based on accumulate "worth" of the reflection
     *         That is, imagine a material with reflectivity 0.1 - once reflected any color has only 0.1 strength - a second
     *         reflection off same material would have an influence of only 0.01 and yet again just 0.001 - most likely quite insignificant!
+    *     objects: Candidate objects for this ray (the screen bin for primary rays), all objects by default
     *     returns the color
     """
-    def shade(self, ray, depth=0, reflective_coefficient=1.0, ignore=[]):
+    def shade(self, ray, depth=0, reflective_coefficient=1.0, ignore=(), objects=None):
         # print("DEBUG: Shade method: Ray: {0}".format(ray))
         color = Color()
         best_hit = Hit()
-        self.intersect(ray, best_hit, ignore=ignore)
+        self.intersect(ray, best_hit, ignore=ignore, objects=objects)
 
         if best_hit.t != -1:
             # print("Ray: {0} intersected: {1}".format(ray, best_hit.obj.name))
-            mat = best_hit.obj.material  # The material property of the object hit
+            mat = best_hit.obj.frozen_material  # The material property of the object hit
             norm = best_hit.norm         # Normal to surface at this location
             norm.normalize()             # Make sure the normal is normalized (unit length)
-            color.set(mat.get_emissive())
-            global_ambient = Color()
-            global_ambient.set(Light.get_global_ambient())
-            global_ambient.mult(mat.get_ambient())
-            color.add(global_ambient)
+            (nx, ny, nz) = (norm.dx, norm.dy, norm.dz)
+            point = best_hit.point
 
-            for light in self.lights:
-                # Calculate the color from this light using Phong Illumination model
-                light_color = Color()
+            # Emissive and every ambient term are precomputed (see prepare_shading)
+            shading = self.shading_tables.get(mat)
+            if shading is None:
+                # Material not seen when the tables were built (e.g. changed mid-frame): built for this hit only,
+                # so render threads never write the shared tables
+                shading = self.build_shading(mat)
+            ((r, g, b, a), lights) = shading
 
-                # Starting with ambient (shadow doesn't matter here)
-                light_color.set(light.get_ambient())
-                light_color.mult(mat.get_ambient())
+            # From hit point to "Eye" (ray source)
+            source = ray.get_source()
+            (vx, vy, vz) = (source.x - point.x, source.y - point.y, source.z - point.z)
+            v_len = math.sqrt(vx * vx + vy * vy + vz * vz)
+            if v_len > 0:
+                (vx, vy, vz) = (vx / v_len, vy / v_len, vz / v_len)
 
-                # See if the object is in shadow from this list
+            for (light, diffuse, specular, lut) in lights:
+                # See if the object is in shadow from this light (ambient is already in the base color)
                 shadow = light.compute_shadow(self, best_hit)
                 if shadow > 0:
-                    lpos = light.get_position()                    
+                    lpos = light.get_position()
                     w = lpos[3]
                     if w == 0:
                         # Light is a directional light (the "position" gives light direction)
-                        s = Vector3(lpos[0], lpos[1], lpos[2])
+                        (sx, sy, sz) = (lpos[0], lpos[1], lpos[2])
                     else:
                         # Light is point source
-                        s = Vector3(lpos[0]/w - best_hit.point.x, lpos[1]/w - best_hit.point.y, lpos[2]/w - best_hit.point.z)
-                    
-                    v = Vector3.from_points(best_hit.point, ray.get_source())  # From hit point to "Eye" (ray source)
-                    s.normalize()
-                    v.normalize()
-
-                    # Compute the Halfway Vector between s and v
-                    h = Vector3(s.dx + v.dx, s.dy + v.dy, s.dz + v.dz)
-                    h.normalize()
+                        (sx, sy, sz) = (lpos[0]/w - point.x, lpos[1]/w - point.y, lpos[2]/w - point.z)
+                    s_len = math.sqrt(sx * sx + sy * sy + sz * sz)
+                    if s_len > 0:
+                        (sx, sy, sz) = (sx / s_len, sy / s_len, sz / s_len)
 
                     # Ready to compute lambertian portion (from diffuse)
-                    lambert = s.dot(norm)
+                    lambert = sx * nx + sy * ny + sz * nz
                     if lambert > 0:
-                        diff_color = Color()
-                        diff_color.set(light.get_diffuse())
-                        diff_color.mult(mat.get_diffuse())
-                        diff_color.dim(lambert)
-                        light_color.add(diff_color)
+                        r += diffuse[0] * lambert
+                        g += diffuse[1] * lambert
+                        b += diffuse[2] * lambert
 
-                        phong = h.dot(norm)
+                        # Phong term from the Halfway Vector between s and v
+                        (hx, hy, hz) = (sx + vx, sy + vy, sz + vz)
+                        h_len = math.sqrt(hx * hx + hy * hy + hz * hz)
+                        phong = (hx * nx + hy * ny + hz * nz) / h_len if h_len > 0 else hx * nx + hy * ny + hz * nz
                         if phong > 0:
-                            spec_color = Color()
-                            spec_color.set(light.get_specular())
-                            spec_color.mult(mat.get_specular())
-                            spec_color.dim(math.pow(phong, mat.get_shininess()))
-                            light_color.add(spec_color)
+                            if lut is None:
+                                power = math.pow(phong, mat.get_shininess())
+                            else:
+                                x = min(phong, 1.0) * self.specular_lut_size
+                                i = int(x)
+                                power = lut[i] + (lut[i + 1] - lut[i]) * (x - i)
+                            r += specular[0] * power
+                            g += specular[1] * power
+                            b += specular[2] * power
 
-                color.add(light_color)
+            color.set_color(r, g, b, a)
 
             reflective_coefficient *= mat.get_reflectivity()
             if reflective_coefficient > self.reflective_coeff_cutoff and depth < self.max_reflection_depth:
@@ -0,0 +1,109 @@
+import math
+
+class ScreenBins:
+    """
+    Per-tile candidate lists of objects for primary rays.
+
+    Each frame, the world-space bounding box of every object is projected through the camera
+    onto the image plane and the object is added to every tile its projection overlaps.
+    A primary ray then only needs to test the objects listed for its tile.
+    Objects entirely behind the camera or outside the view angle end up in no tile at all,
+    while unbounded objects (planes) are added to every tile.
+    """
+
+    # Corner indices (x, y, z bits) of the 12 edges of a box, used to clip boxes at the camera plane
+    EDGES = (
+        (0, 1), (2, 3), (4, 5), (6, 7),     # along z
+        (0, 2), (1, 3), (4, 6), (5, 7),     # along y
+        (0, 4), (1, 5), (2, 6), (3, 7),     # along x
+    )
+    MIN_DEPTH = 1e-6    # Boxes are clipped just in front of the eye
+
+    def __init__(self, tile_size=32):
+        self.tile_size = tile_size
+        self.tiles = [[]]
+
+    def build(self, objects, camera, width, height):
+        ts = self.tile_size
+        n_tile_rows = (height + ts - 1) // ts
+        n_tile_cols = (width + ts - 1) // ts
+        self.tiles = [[[] for c in range(n_tile_cols)] for r in range(n_tile_rows)]
+
+        # Same image plane as Scene.render_ray_traced: the sample at (row, col) looks through
+        #   -N*n + uc*u + vr*v  with  uc = -W + col*2W/width  and  vr = H - row*2H/height
+        N = camera.near_dist
+        H = N * math.tan(math.radians(camera.angle/2))
+        W = H * camera.aspect_ratio
+
+        for obj in objects:
+            if not obj.frozen:
+                obj.freeze()
+            if obj.world_min is None:
+                for row_tiles in self.tiles:
+                    for tile in row_tiles:
+                        tile.append(obj)
+                continue
+            rect = self.project_box(obj.world_min, obj.world_max, camera, N, W, H)
+            if rect is None:
+                continue    # Behind the camera
+
+            # Convert the image plane rectangle to pixels (padded by one for round off) and then to tiles
+            (u_min, u_max, v_min, v_max) = rect
+            col_min = (u_min + W) * width / (2*W) - 1
+            col_max = (u_max + W) * width / (2*W) + 1
+            row_min = (H - v_max) * height / (2*H) - 1
+            row_max = (H - v_min) * height / (2*H) + 1
+            if col_max < 0 or row_max < 0 or col_min >= width or row_min >= height:
+                continue    # Outside the view angle
+
+            tc0 = max(0, int(col_min // ts))
+            tc1 = min(n_tile_cols - 1, int(col_max // ts))
+            tr0 = max(0, int(row_min // ts))
+            tr1 = min(n_tile_rows - 1, int(row_max // ts))
+            for tr in range(tr0, tr1 + 1):
+                row_tiles = self.tiles[tr]
+                for tc in range(tc0, tc1 + 1):
+                    row_tiles[tc].append(obj)
+
+    """
+    Project a world-space box onto the image plane (at distance N in front of the eye).
+    The box is clipped at MIN_DEPTH first, so boxes reaching behind the camera still project correctly.
+    Returns (u_min, u_max, v_min, v_max) or None if the box is entirely behind the camera.
+    """
+    def project_box(self, lo, hi, camera, N, W, H):
+        eye = camera.eye
+        (u, v, n) = (camera.u, camera.v, camera.n)
+
+        # Corners in camera coordinates (x right, y up, depth forward)
+        corners = []
+        for i in range(8):
+            px = (hi if i & 4 else lo)[0] - eye.x
+            py = (hi if i & 2 else lo)[1] - eye.y
+            pz = (hi if i & 1 else lo)[2] - eye.z
+            corners.append((
+                px * u.dx + py * u.dy + pz * u.dz,
+                px * v.dx + py * v.dy + pz * v.dz,
+                -(px * n.dx + py * n.dy + pz * n.dz)
+            ))
+
+        # Keep corners in front and add the points where edges cross the clipping plane
+        points = [c for c in corners if c[2] >= ScreenBins.MIN_DEPTH]
+        if len(points) == 0:
+            return None
+        if len(points) < 8:
+            for (i, j) in ScreenBins.EDGES:
+                (a, b) = (corners[i], corners[j])
+                if (a[2] < ScreenBins.MIN_DEPTH) != (b[2] < ScreenBins.MIN_DEPTH):
+                    t = (ScreenBins.MIN_DEPTH - a[2]) / (b[2] - a[2])
+                    points.append((a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1]), ScreenBins.MIN_DEPTH))
+
+        us = [N * x / depth for (x, y, depth) in points]
+        vs = [N * y / depth for (x, y, depth) in points]
+        return (min(us), max(us), min(vs), max(vs))
+
+    def candidates(self, row, col):
+        return self.tiles[row // self.tile_size][col // self.tile_size]
+
+    def average_candidates(self):
+        counts = [len(tile) for row_tiles in self.tiles for tile in row_tiles]
+        return sum(counts) / len(counts)
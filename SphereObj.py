@@ -1,5 +1,5 @@
 
-from GeomObj import GeomObj
+from GeomObj import GeomObj, TRANSFORM_IDENTITY, TRANSFORM_TRANSLATE, TRANSFORM_UNIFORM
 from Ray import Ray
 from Hit import Hit
 from Point3 import Point3
@@ -10,11 +10,24 @@ from OpenGL.GLU import *
 class SphereObj(GeomObj):
     def __init__(self, resolution=100):
         super().__init__()
-        self.ball = gluNewQuadric()
+        self.ball = self.new_quadric()
         self.resolution = resolution
-        gluQuadricDrawStyle(self.ball, GLU_FILL)
+
+    def new_quadric(self):
+        ball = gluNewQuadric()
+        gluQuadricDrawStyle(ball, GLU_FILL)
+        return ball
+
+    # The GLU quadric is a ctypes pointer that cannot be pickled (e.g. for worker processes),
+    # so copies drop it and create their own the first time they are drawn
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['ball'] = None
+        return state
 
     def render_solid(self):
+        if self.ball is None:
+            self.ball = self.new_quadric()
         gluSphere(self.ball, 1, self.resolution, self.resolution)
 
     def render_wire(self):
@@ -24,13 +37,71 @@ class SphereObj(GeomObj):
         # Reset the sphere's transformations
         self.matrix.load_identity()
         self.matrix_inverse.load_identity()
+        self.thaw()
+
+    def local_bounding_sphere(self):
+        # The unit sphere is its own (tightest) bounding sphere
+        return ((0, 0, 0), 1)
+
+    def prepare_origin(self, source):
+        super().prepare_origin(source)
+        if source is not None:
+            # Origin-only terms of both the world-space and the local quadratic
+            (cx, cy, cz) = self.world_center
+            (ox, oy, oz) = (source.x - cx, source.y - cy, source.z - cz)
+            r = self.world_radius
+            self.origin_world_terms = (ox, oy, oz, ox ** 2 + oy ** 2 + oz ** 2 - r * r)
+            s = self.origin_local
+            self.origin_c = s.x ** 2 + s.y ** 2 + s.z ** 2 - 1
+
+    def intersect(self, ray, best_hit):
+        if not self.frozen:
+            self.freeze()
+        kind = self.transform_kind
+        if kind != TRANSFORM_IDENTITY and kind != TRANSFORM_TRANSLATE and kind != TRANSFORM_UNIFORM:
+            return super().intersect(ray, best_hit)
+
+        # Without rotation or stretching the sphere stays a sphere in world space,
+        # so test it there directly (same t as the local test, no transforms needed).
+        # It is its own bounding sphere, so there is no separate early out here.
+        (cx, cy, cz) = self.world_center
+        s = ray.source
+        c = ray.dir
+        if s is self.origin_source:
+            (ox, oy, oz, C) = self.origin_world_terms
+        else:
+            r = self.world_radius
+            (ox, oy, oz) = (s.x - cx, s.y - cy, s.z - cz)
+            C = ox ** 2 + oy ** 2 + oz ** 2 - r * r
+        A = c.dx ** 2 + c.dy ** 2 + c.dz ** 2
+        B = 2 * (ox * c.dx + oy * c.dy + oz * c.dz)
+        discriminant = B ** 2 - 4 * A * C
+
+        if discriminant < 0:
+            return False
+
+        sqrt_disc = discriminant ** 0.5
+        t1 = (-B - sqrt_disc) / (2 * A)
+        t2 = (-B + sqrt_disc) / (2 * A)
+        t = min(t1, t2) if t1 > 0 and t2 > 0 else max(t1, t2)
+
+        if t < 0 or (t >= best_hit.t and best_hit.t != -1):
+            return False
+
+        best_hit.t = t
+        best_hit.point = ray.eval(t)
+        best_hit.norm = Vector3(best_hit.point.x - cx, best_hit.point.y - cy, best_hit.point.z - cz)
+        best_hit.norm.normalize()
+        best_hit.obj = self
+        best_hit.texture_color = Color(1, 1, 1, 1) # defaults to white
+        return True
 
     def local_intersect(self, ray, best_hit):
         s = ray.source
         c = ray.dir
         A = c.dx ** 2 + c.dy ** 2 + c.dz ** 2
         B = 2 * (s.x * c.dx + s.y * c.dy + s.z * c.dz)
-        C = s.x ** 2 + s.y ** 2 + s.z ** 2 - 1
+        C = self.origin_c if s is self.origin_local else s.x ** 2 + s.y ** 2 + s.z ** 2 - 1
         discriminant = B ** 2 - 4 * A * C
 
         if discriminant < 0:
@@ -0,0 +1,87 @@
+import time
+import multiprocessing
+from Window import Window
+from RGBPixmap import RGBPixmap
+from TileScheduler import TileScheduler
+
+class TilePool:
+    """
+    Persistent pool of worker processes that ray trace the tiles of one frame at a time
+    straight into a shared memory RGBPixmap.
+
+    As with RecordPool, each worker keeps a snapshot of the scene and a frame only costs its small
+    state (camera, light angle), posed by apply_state(scene, state). Workers write their tiles in
+    place in the shared pixmap, so only the tile and its render time are sent back; once render returns,
+    the pixmap holds the whole frame and can be saved directly (Window.save_pixmap(filename, pool.pixmap)).
+    For images too large to keep in memory, the pixmap can be a .npy file (filename) instead of shared memory.
+    Tiles are handed out one at a time, in the order chosen by a TileScheduler.
+    """
+
+    def __init__(self, scene, apply_state, width, height, processes=None, tile_size=32, filename=None):
+        self.width = width
+        self.height = height
+        self.scheduler = TileScheduler(tile_size)
+        self.processes = processes if processes is not None else multiprocessing.cpu_count()
+        self.pixmap = RGBPixmap(height, width, shared=filename is None, filename=filename)
+        self.frame_count = 0
+        self.cancel_event = multiprocessing.Event()     # Set to make workers skip the rest of a frame's tiles
+        self.pool = multiprocessing.Pool(self.processes, initializer=TilePool.init_worker,
+                                         initargs=(scene, apply_state, self.pixmap, self.cancel_event))
+
+    def matches(self, width, height):
+        return (self.width, self.height) == (width, height)
+
+    """
+    Ray trace the frame described by state into self.pixmap, returning it once every tile is done.
+    progress, if given, is called with the fraction of tiles done; when it returns False the
+    remaining tiles are skipped and None is returned.
+    """
+    def render(self, state, block_size=1, progress=None):
+        self.frame_count += 1
+        tiles = self.scheduler.tiles(self.width, self.height, block_size)
+        messages = [(self.frame_count, state, block_size, tile) for tile in tiles]
+        completed = 0
+        # chunksize 1 so idle workers always take the next tile in schedule order
+        for (tile, seconds) in self.pool.imap_unordered(TilePool.render_tile, messages, chunksize=1):
+            completed += 1
+            if seconds is not None:
+                self.scheduler.record(tile, seconds)  # The pixels are already written in place
+            if progress is not None and not self.cancel_event.is_set() and progress(completed / len(tiles)) is False:
+                self.cancel_event.set()
+        # Every tile has been answered (skipped ones right away), so none can still write into the pixmap
+        if self.cancel_event.is_set():
+            self.cancel_event.clear()
+            return None
+        return self.pixmap
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.pixmap.close()
+
+    # Worker process side: [scene, apply_state, window, cancel_event, frame being rendered], set up once by init_worker
+    worker = None
+
+    @staticmethod
+    def init_worker(scene, apply_state, pixmap, cancel_event):
+        scene.verbose = False
+        window = Window(pixmap.n_cols, pixmap.n_rows, pixmap=pixmap)
+        TilePool.worker = [scene, apply_state, window, cancel_event, None]
+
+    @staticmethod
+    def render_tile(message):
+        (frame, state, block_size, tile) = message
+        (r0, r1, c0, c1) = tile
+        (scene, apply_state, window, cancel_event, current) = TilePool.worker
+        if cancel_event.is_set():
+            return (tile, None)
+        if current != frame:
+            # First tile of a new frame for this worker
+            if current is not None:
+                scene.end_frame()
+            apply_state(scene, state)
+            scene.begin_frame(state[0], window.width, window.height, block_size)
+            TilePool.worker[4] = frame
+        start = time.perf_counter()
+        scene.render_tile(window, r0, r1, c0, c1)
+        return (tile, time.perf_counter() - start)
@@ -0,0 +1,52 @@
+class TileScheduler:
+    """
+    Chooses the order the tiles of a frame are handed out to workers in (see TilePool and RenderCoordinator).
+
+    Tiles follow a Morton (Z-order) curve over the tile grid, so tiles rendered one after another
+    are close together on screen and hit mostly the same objects.
+    Workers report how long each tile took and the next frame uses those times as cost estimates:
+    tiles are grouped into COST_LEVELS levels relative to the most expensive one, and the most
+    expensive level goes first (in Morton order within each level). Cheap tiles are then left for
+    the end of the frame, where they fill the gaps instead of one slow tile holding everyone up.
+    Estimates are dropped whenever the frame size or tile layout changes.
+    """
+
+    COST_LEVELS = 8
+
+    def __init__(self, tile_size=32):
+        self.tile_size = tile_size
+        self.layout = None  # (width, height, tile size) the costs were measured with
+        self.costs = {}     # tile -> seconds it took last time
+
+    """
+    The tiles of a width x height frame as (row_start, row_end, col_start, col_end), in the order to render them.
+    Tile edges are rounded up to whole blocks.
+    """
+    def tiles(self, width, height, block_size=1):
+        ts = (self.tile_size + block_size - 1) // block_size * block_size
+        if self.layout != (width, height, ts):
+            self.layout = (width, height, ts)
+            self.costs = {}
+        tiles = [(r, min(r + ts, height), c, min(c + ts, width)) for r in range(0, height, ts) for c in range(0, width, ts)]
+        tiles.sort(key=lambda tile: TileScheduler.morton(tile[0] // ts, tile[2] // ts))
+
+        if len(self.costs) > 0:
+            most = max(self.costs.values())
+            if most > 0:
+                # Tiles without an estimate yet are assumed to be as expensive as the worst one
+                tiles.sort(key=lambda tile: -int(self.costs.get(tile, most) / most * (TileScheduler.COST_LEVELS - 1) + 0.5))
+        return tiles
+
+    def record(self, tile, seconds):
+        self.costs[tile] = seconds
+
+    # Interleave the bits of the tile row and column (row bits in the odd positions)
+    @staticmethod
+    def morton(row, col):
+        code = 0
+        bit = 0
+        while (row >> bit) or (col >> bit):
+            code |= ((col >> bit) & 1) << (2 * bit)
+            code |= ((row >> bit) & 1) << (2 * bit + 1)
+            bit += 1
+        return code
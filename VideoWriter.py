@@ -0,0 +1,73 @@
+import numpy as np
+from RGBPixmap import RGBPixmap
+try:
+    import imageio_ffmpeg
+except ImportError:
+    imageio_ffmpeg = None   # Only needed for recording straight to video
+
+class VideoWriter:
+    """
+    Streams ray traced frames as raw RGB into an ffmpeg process (through imageio-ffmpeg) as they
+    finish, so a recording becomes a video without saving and reloading an image per frame.
+
+    write(frame, index) takes frame number index (from 0), an RGBPixmap (copied) or an array of
+    pixels (rows, cols, 3) handed over as it is. Float pixels are only converted for the video, so
+    stills keep them (e.g. as npy). Frames may arrive in any order: the ones that come
+    early wait in a reorder buffer until the frames before them are written.
+    stills, if given, is a FrameWriter that also saves every frame as an image (named by still_names),
+    in which case filename may be None to only write the stills.
+    close() finishes the video; frames after a missing one (e.g. a cancelled recording) are dropped.
+    """
+
+    def __init__(self, filename, width, height, fps=24, codec='libx264', stills=None, still_names='frame{0:04}.png'):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.stills = stills
+        self.still_names = still_names
+        self.pending = {}           # Frames that arrived before the ones ahead of them, by index
+        self.next_index = 0
+        self.encoder = None
+        if filename is not None:
+            if imageio_ffmpeg is None:
+                raise RuntimeError("Recording to video needs the imageio-ffmpeg package")
+            # macro_block_size 2 keeps the size as is (yuv420p only needs it even), rather than scaling to a multiple of 16
+            self.encoder = imageio_ffmpeg.write_frames(filename, (width, height), fps=fps, codec=codec,
+                                                       pix_fmt_in='rgb24', macro_block_size=2)
+            self.encoder.send(None)     # Starts ffmpeg
+
+    # True if imageio-ffmpeg is installed, so frames can go straight to video
+    @staticmethod
+    def available():
+        return imageio_ffmpeg is not None
+
+    def write(self, frame, index):
+        if isinstance(frame, RGBPixmap):
+            frame = frame.pixel.copy()
+        self.pending[index] = frame
+        while self.next_index in self.pending:
+            pixels = self.pending.pop(self.next_index)
+            if self.encoder is not None:
+                rgb8 = pixels if pixels.dtype == np.uint8 else (np.clip(pixels, 0.0, 1.0) * 255).astype(np.uint8)
+                self.encoder.send(np.ascontiguousarray(rgb8))   # Written to ffmpeg's pipe, it encodes in its own process
+            if self.stills is not None:
+                self.stills.write(pixels, self.still_names.format(self.next_index + 1))
+            self.next_index += 1
+
+    # Number of frames in the video so far
+    def frames_written(self):
+        return self.next_index
+
+    def close(self):
+        if self.pending:
+            print("Dropped {0} frame(s) recorded after missing frame {1}".format(len(self.pending), self.next_index + 1))
+            self.pending = {}
+        try:
+            if self.encoder is not None:
+                encoder = self.encoder
+                self.encoder = None
+                encoder.close()
+                print("Video saved as '{0}' ({1} frames)".format(self.filename, self.next_index))
+        finally:
+            if self.stills is not None:
+                self.stills.close()
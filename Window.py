@@ -1,16 +1,23 @@
 
+import time
+import numpy as np
 import pygame
 from pygame.locals import *
 from OpenGL.GL import *
 from RGBPixmap import RGBPixmap
 
 class Window:
-    def __init__(self, width, height, title="PyGame Window"):
+    def __init__(self, width, height, title="PyGame Window", pixmap=None, pixel_format='uint8'):
         self.width = width
         self.height = height
         self.title = title
         self.screen = None
-        self.pixmap = RGBPixmap(self.height, self.width)
+        self.pixmap = RGBPixmap(self.height, self.width, pixel_format=pixel_format) if pixmap is None else pixmap   # e.g. a shared one, see TilePool
+        self.pixmap_texture = None          # OpenGL texture draw_pixmap uploads to
+        self.pixmap_texture_size = None
+        self.uploaded_pixmap = None         # ... the pixmap it last uploaded
+        self.uploaded_time = 0
+        self.pixmap_refresh_interval = 0.25 # Seconds between uploads of a pixmap that is still being filled in
 
     def initialize(self):
         pygame.init()
@@ -27,10 +34,14 @@ class Window:
         # Write a pixel of given block_size IN THE PIXMAP Array
         self.pixmap.set_pixel(row, col, color, block_size)
 
-    def save_pixmap(self, filename):
-        surface = pygame.Surface((self.width, self.height))
-        self.pixmap.copy_to_surface(surface)
-        pygame.image.save(surface, filename)
+    def draw_row(self, row, col, colors, block_size=1):
+        # Write a row of blocks starting at (row, col) IN THE PIXMAP Array, one color per block
+        self.pixmap.set_row(row, col, colors, block_size)
+
+    def save_pixmap(self, filename, pixmap=None):
+        # Saves this window's pixmap, or another one (such as a TilePool's, read where the workers wrote it)
+        pixmap = self.pixmap if pixmap is None else pixmap
+        pixmap.save(filename)
         print("Rendered image saved as '{0}'".format(filename))
 
     def prepare_window(self):
@@ -40,3 +51,59 @@ class Window:
         glClearColor(0.0, 0.0, 0.0, 0.0)
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
+    def draw_pixmap(self, pixmap=None):
+        """ Draw a pixmap (this window's by default) over the whole window, e.g. to watch a ray trace fill in.
+        The pixels are uploaded as an OpenGL texture at most every pixmap_refresh_interval seconds, in between
+        the last upload is drawn again, so showing a render in progress costs little of the render's time."""
+        pixmap = self.pixmap if pixmap is None else pixmap
+        step = max(1, pixmap.n_cols // self.width, pixmap.n_rows // self.height)    # Images larger than the window only upload every step-th pixel
+        if self.pixmap_texture is None:
+            self.pixmap_texture = glGenTextures(1)
+        glPushAttrib(GL_ENABLE_BIT | GL_TEXTURE_BIT)
+        glBindTexture(GL_TEXTURE_2D, self.pixmap_texture)
+
+        now = time.time()
+        if pixmap is not self.uploaded_pixmap or now - self.uploaded_time >= self.pixmap_refresh_interval:
+            # The array is uploaded as is (no copy), row 0 first, in whatever format the pixmap stores
+            (pixel_format, pixel_type) = pixmap.gl_format()
+            pixels = pixmap.pixel if step == 1 else np.ascontiguousarray(pixmap.pixel[::step, ::step])
+            size = (pixels.shape[1], pixels.shape[0], pixel_type)
+            glPixelStorei(GL_UNPACK_ALIGNMENT, 1)   # Rows of 3 byte pixels need not be 4 byte aligned
+            if self.pixmap_texture_size != size:
+                glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, size[0], size[1], 0, pixel_format, pixel_type, pixels)
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+                self.pixmap_texture_size = size
+            else:
+                glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, size[0], size[1], pixel_format, pixel_type, pixels)
+            glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+            self.uploaded_pixmap = pixmap
+            self.uploaded_time = now
+
+        glViewport(0, 0, self.width, self.height)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_DEPTH_TEST)
+        glEnable(GL_TEXTURE_2D)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_REPLACE)
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+
+        # Row 0 is the top of the image
+        glBegin(GL_QUADS)
+        glTexCoord2f(0, 0); glVertex2f(-1, 1)
+        glTexCoord2f(1, 0); glVertex2f(1, 1)
+        glTexCoord2f(1, 1); glVertex2f(1, -1)
+        glTexCoord2f(0, 1); glVertex2f(-1, -1)
+        glEnd()
+
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopAttrib()
+        glFlush()
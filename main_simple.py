@@ -10,10 +10,12 @@ scene and then the ability to render that scene using ray tracing. The implement
 But making it efficient is an entirely more complex task.
 """
 
+import os
 import sys
 import math
 import pygame
 import copy
+import multiprocessing
 from OpenGL.GLU import *
 from OpenGL.GL import *
 from Navigator import Navigator
@@ -25,6 +27,18 @@ from Scene import Scene
 from SphereObj import SphereObj
 from BoxObj import BoxObj
 from CylinderObj import CylinderObj
+from QuadObj import QuadObj
+from InstanceObj import InstanceObj
+from RecordPool import RecordPool
+from BackgroundRenderer import BackgroundRenderer, RenderJob
+from RGBPixmap import RGBPixmap
+from FrameWriter import FrameWriter
+from VideoWriter import VideoWriter
+from FrameCache import FrameCache
+from TilePool import TilePool
+from RenderCoordinator import RenderCoordinator
+from RenderWorker import RenderWorker
+from LoopingLight import LoopingLight
 from Material import Material
 from Light import Light
 from Color import Color
@@ -55,6 +69,8 @@ light_speed = 1
 # TODO: remove faster speed
 # light_speed = 10
 light_distance = 5
+looping_light = LoopingLight(light_distance)
+apply_record_state = looping_light.apply_state  # Poses a copy of the scene to match a state from get_copy_state
 animate = True  # Animation
 
 # Enums for rendering modes
@@ -65,18 +81,33 @@ render_mode = RENDER_SOLID
 raytrace_count = 0  # How many ray traced images have been generated so far
 
 block_size = 4
+render_width = None     # Size of ray traced images, None follows the window (times render_scale)
+render_height = None
+render_scale = 1        # Cycled with R
+record_video = VideoWriter.available()  # Stream recordings straight into recording<n>.mp4
+record_stills = not record_video    # Also save each recorded frame as an image
+frame_format = 'png'    # Format recorded frames are written in: png, ppm or npy (see FrameWriter)
+frame_png_compression = 1   # zlib level for png frames, 1 is fast
+recording_count = 0     # How many recordings have been made so far
+use_frame_cache = True  # Reuse frames ray traced before with the same scene, camera and settings (see FrameCache)
+frame_cache_dir = 'framecache'
+frame_cache_bytes = 1 << 30     # Least recently used frames are removed past this size
+frame_cache = None      # Opened on first use
+free_threaded = not getattr(sys, '_is_gil_enabled', lambda: True)()   # Python build without the GIL
+render_threads = multiprocessing.cpu_count() if free_threaded else 0     # Threads ray tracing tiles in this process (Scene.render_threads)
+record_processes = multiprocessing.cpu_count()  # Worker processes ray tracing recorded frames, 1 renders them in this process
+record_pool = None  # RecordPool kept between recordings (see get_record_pool)
+tile_pool = None    # TilePool kept between single images (see get_tile_pool)
+render_workers = 0  # Local socket workers for recordings (see RenderCoordinator), 0 uses record_processes instead
+render_address = ('localhost', 0)   # Where the coordinator listens, more workers can join from other machines
+render_coordinator = None
+renderer = None     # BackgroundRenderer ray tracing queued images and recordings while the preview keeps running, started in main
+show_live_render = True     # Show the ray traced image filling in instead of the preview while it renders
 
 # Functions
 def set_looping_light_positions(lightA):
-    global light_angle, light_distance
-    pos_x = light_distance * math.cos(math.radians(light_angle))
-    pos_y = light_distance * math.sin(math.radians(light_angle))
-    pos_z = 0
-
-    lightA.set_position(pos_x, pos_y, pos_z)
-    lightA.obj.reset()
-    lightA.obj.translate(pos_x, pos_y, pos_z)
-    lightA.obj.scale(0.2, 0.2, 0.2)
+    global light_angle
+    looping_light.place(lightA, light_angle)
 
 def init_scene():
     global scn, nav, lightA
@@ -222,58 +253,63 @@ def init_scene():
     scn.add_object(ball4)
 
     # walls
+    # the room is only ever seen from inside, so each side is a single quad facing into the room
     mat = Material() # uses the flat default material
     mat.set_reflectivity(0.1)
-    ceiling = BoxObj()
+    ceiling = QuadObj()
     ceiling.set_texture('resources/ceiling.png', 128)
     ceiling.name = "Ceiling"
     ceiling.set_material(mat)
-    ceiling.translate(0, 8, 0)
-    ceiling.scale(15, 0.1, 15)
+    ceiling.translate(0, 7.9, 0)
+    ceiling.rotate(90, Vector3(1, 0, 0))
+    ceiling.scale(15, 15, 1)
     scn.add_object(ceiling)
     
     mat = Material()
     mat.set_silver()
     mat.set_reflectivity(0.3)
-    floor = BoxObj()
+    floor = QuadObj()
     floor.name = "Floor"
     floor.set_material(mat)
-    floor.translate(0, -2, 0)
-    floor.scale(15, 0.1, 15)
+    floor.translate(0, -1.9, 0)
+    floor.rotate(-90, Vector3(1, 0, 0))
+    floor.scale(15, 15, 1)
     scn.add_object(floor)
 
+    # the four walls are instances of one quad, sharing its texture
     mat = Material() # uses the flat default material
     mat.set_reflectivity(0.1)
-    forward_wall = BoxObj()
-    forward_wall.set_texture('resources/lattice.png', 128)
+    wall = QuadObj()
+    wall.set_texture('resources/lattice.png', 128)
+    wall.name = "Wall"
+    wall.set_material(mat)
+
+    forward_wall = InstanceObj(wall)
     forward_wall.name = "Forward Wall"
-    forward_wall.set_material(mat)
-    forward_wall.translate(0, 3, -15)
-    forward_wall.scale(15, 5, 1)
+    forward_wall.translate(0, 3, -14)
+    forward_wall.scale(-15, 5, 1)
     scn.add_object(forward_wall)
 
-    backward_wall = BoxObj()
-    backward_wall.set_texture('resources/lattice.png', 128)
+    backward_wall = InstanceObj(wall)
     backward_wall.name = "Backward Wall"
-    backward_wall.set_material(mat)
-    backward_wall.translate(0, 3, 15)
-    backward_wall.scale(15, 5, 1)
+    backward_wall.translate(0, 3, 14)
+    backward_wall.scale(-15, -5, -1)
     scn.add_object(backward_wall)
 
-    left_wall = BoxObj()
-    left_wall.set_texture('resources/lattice.png', 128)
+    left_wall = InstanceObj(wall)
     left_wall.name = "Left Wall"
-    left_wall.set_material(mat)
-    left_wall.translate(-15, 3, 0)
-    left_wall.scale(1, 5, 14)
+    left_wall.translate(-14, 3, 0)
+    left_wall.rotate(90, Vector3(0, 1, 0))
+    left_wall.rotate(90, Vector3(0, 0, 1))
+    left_wall.scale(5, 14, 1)
     scn.add_object(left_wall)
 
-    right_wall = BoxObj()
-    right_wall.set_texture('resources/lattice.png', 128)
+    right_wall = InstanceObj(wall)
     right_wall.name = "Right Wall"
-    right_wall.set_material(mat)
-    right_wall.translate(15, 3, 0)
-    right_wall.scale(1, 5, 14)
+    right_wall.translate(14, 3, 0)
+    right_wall.rotate(-90, Vector3(0, 1, 0))
+    right_wall.rotate(-90, Vector3(0, 0, 1))
+    right_wall.scale(5, 14, 1)
     scn.add_object(right_wall)
 
     # Light setup
@@ -337,6 +373,11 @@ def init_scene():
     lightD.obj.translate(8, 5, 8)
     lightD.obj.scale(0.2, 0.2, 0.2)
 
+# Build the scene without opening the window, for RenderServer: (scene, apply_state, default camera)
+def build_scene():
+    init_scene()
+    return (scn, apply_record_state, nav.get_camera())
+
 # Return a copy of all the things in scene that could have changed!
 def get_copy_state():
     return (copy.deepcopy(nav.camera), light_angle)
@@ -349,19 +390,20 @@ def restore_state(state):
     set_looping_light_positions(lightA)
 
 def display():
-    global render_mode, raytrace_count, animate, record
+    global render_mode, animate, record
     if render_mode == RENDER_SOLID:
-        scn.render_solid(nav.get_camera(), win)
+        (job, waiting) = renderer.status()
+        if show_live_render and job is not None and job.pixmap is not None:
+            win.draw_pixmap(job.pixmap)     # Throttled, so watching costs the render very little
+        else:
+            scn.render_solid(nav.get_camera(), win)
         pygame.display.flip()
     elif render_mode == RENDER_RAY_SINGLE:
-        scn.render_solid(nav.get_camera(), win)   # Render solid first so user can see it
+        scn.render_solid(nav.get_camera(), win)
         pygame.display.flip()
-        scn.render_ray_traced(nav.get_camera(), win, block_size)
-        win.save_pixmap('image{0}.png'.format(raytrace_count))
-        raytrace_count+=1
+        queue_single_render()   # Ray traced in the background, the preview keeps running meanwhile
         animate = False
         render_mode = RENDER_SOLID # So doesn't try to render it again!
-        pygame.event.clear() # Takes so long to render, need to clear events that happened while rendering!
     elif render_mode == RENDER_RAY_RECORD:
         scn.render_solid(nav.get_camera(), win)   # Render solid first so user can see it
         pygame.display.flip()
@@ -369,29 +411,251 @@ def display():
             # Save a copy of the things that could change from scene to scene
             record.append(get_copy_state())
 
-# Ray trace a sequence of frames - each step recorded to recreate
-def raytrace_records(record):
-    # Save the current state
-    save_state = get_copy_state()
+# Show what the background renderer is doing in the window title
+def show_render_status():
+    (job, waiting) = renderer.status()
+    if job is None:
+        caption = FRAME_TITLE
+    elif job.frames > 1:
+        caption = "{0} - {1}: frame {2} of {3}, {4:.0%}".format(FRAME_TITLE, job.name, job.frame + 1, job.frames, job.progress())
+    else:
+        caption = "{0} - {1}: {2:.0%}".format(FRAME_TITLE, job.name, job.progress())
+    if waiting > 0:
+        caption += " ({0} queued)".format(waiting)
+    if caption != pygame.display.get_caption()[0]:
+        pygame.display.set_caption(caption)
 
-    record_count = 1
-    for s in record:
-        print("Recording frame {0} of {1}".format(record_count, len(record)))
-        # Restore state back to this saved record
-        restore_state(s)
-        scn.render_solid(nav.get_camera(), win)   # Render solid first so user can see it
-        pygame.display.flip()
-        scn.render_ray_traced(nav.get_camera(), win, block_size)
-        win.save_pixmap('frame{0:04}.png'.format(record_count))
-        record_count+=1
+"""
+Queue a ray trace of the current view on the background renderer.
+Everything the render needs is copied now, so the view can keep moving. Worker pools are only
+fetched (and a pool of the wrong size replaced) by the job itself, once the jobs before it are done with theirs.
+"""
+def queue_single_render():
+    global raytrace_count
+    state = get_copy_state()
+    (width, height) = render_size()
+    state[0].aspect_ratio = width / height
+    filename = 'image{0}.png'.format(raytrace_count)
+    raytrace_count+=1
+    bs = block_size
+    job = RenderJob("Ray tracing {0} ({1}x{2})".format(filename, width, height))
+
+    # trace(job) ray traces the image, returning the pixmap it is in or None if cancelled
+    scene = copy.deepcopy(scn)
+    if record_processes > 1 and render_threads <= 1:
+        def trace(job):
+            pool = get_tile_pool(scene, width, height)
+            print("Ray tracing with {0} worker processes".format(pool.processes))
+            job.pixmap = pool.pixmap
+            return pool.render(state, bs, progress=job.update)
+    else:
+        window = new_render_window(width, height, filename)
+        def trace(job):
+            scene.progress = job.update
+            job.pixmap = window.pixmap
+            return window.pixmap if scene.render_ray_traced(state[0], window, bs) else None
+
+    def render(job):
+        cache = get_frame_cache()
+        key = FrameCache.frame_key(scene, apply_record_state, state, width, height, bs) if cache is not None else None
+        pixels = cache.get(key) if cache is not None else None
+        if pixels is not None:
+            print("Image found in the frame cache")
+            pixmap = RGBPixmap(height, width, pixel_format=pixels.dtype.name)
+            pixmap.pixel[:] = pixels
+            job.pixmap = pixmap
+        else:
+            pixmap = trace(job)
+            if pixmap is None:
+                return
+            if cache is not None:
+                cache.put(key, pixmap.pixel)
+        win.save_pixmap(filename, pixmap)
+        job.outputs.append(filename)
+    renderer.submit(job, render)
 
-    pygame.event.clear() # Takes so long to render, need to clear events that happened while rendering!
+"""
+Queue a ray trace of a sequence of recorded frames on the background renderer.
+Frames go to socket render workers, a process pool, or a copy of the scene, depending on the settings.
+As with single images, the workers are fetched by the job, from the copy of the scene taken now.
+"""
+def queue_record_render(record):
+    (width, height) = render_size()
+    states = list(record)
+    for state in states:
+        state[0].aspect_ratio = width / height
+    bs = block_size
+    job = RenderJob("Recording", len(states))
+    scene = copy.deepcopy(scn)
+
+    # record(job, output, workers) writes every frame to output: the ones found in the frame cache straight away,
+    # only the others (todo, by index) are ray traced, by the workers from get_workers() if any
+    if render_workers > 0:
+        get_workers = lambda: get_render_coordinator(scene)
+        def record(job, output, coordinator):
+            (keys, todo) = write_cached_frames(scene, states, width, height, bs, output)
+            # Distributed frames are only cancelled between frames
+            print("Recording {0} frames with {1} render workers".format(len(todo), len(coordinator.workers)))
+            for (i, pixmap) in coordinator.render_frames([states[index] for index in todo], width, height, bs):
+                index = todo[i]
+                job.pixmap = pixmap
+                output.write(pixmap.pixel, index)  # A new pixmap each frame, so no copy
+                cache_frame(keys[index], pixmap.pixel)
+                if not job.update(0.0, index + 1):
+                    break
+    elif record_processes > 1 and render_threads <= 1:
+        get_workers = lambda: get_record_pool(scene, width, height, bs)
+        def record(job, output, pool):
+            (keys, todo) = write_cached_frames(scene, states, width, height, bs, output)
+            print("Recording {0} frames with {1} worker processes".format(len(todo), pool.processes))
+            frames = pool.render([states[index] for index in todo], cancelled=job.cancelled)
+            pixmap = RGBPixmap(height, width)
+            try:
+                for (i, pixels) in frames:
+                    index = todo[i]
+                    if pixels is None or not job.update(0.0, index + 1):
+                        break
+                    pixmap.pixel[:] = pixels    # For the live view
+                    job.pixmap = pixmap
+                    output.write(pixels, index)
+                    cache_frame(keys[index], pixels)
+            finally:
+                frames.close()
+    else:
+        window = new_render_window(width, height, 'frame.png')
+        get_workers = lambda: None
+        def record(job, output, workers):
+            job.pixmap = window.pixmap
+            (keys, todo) = write_cached_frames(scene, states, width, height, bs, output)
+            for index in todo:
+                state = states[index]
+                print("Recording frame {0} of {1}".format(index + 1, len(states)))
+                apply_record_state(scene, state)
+                scene.progress = lambda fraction, index=index: job.update(fraction, index)
+                if not scene.render_ray_traced(state[0], window, bs):
+                    break
+                output.write(window.pixmap, index)     # Copied, then saved while the next frame renders
+                cache_frame(keys[index], window.pixmap.pixel)
+
+    def render(job):
+        # Workers first: processes forked once ffmpeg is running would hold its input open, so it would never finish
+        workers = get_workers()
+        output = new_recording_output(job, width, height)
+        try:
+            record(job, output, workers)
+        finally:
+            close_recording_output(job, output)     # Even when recording fails, so ffmpeg finishes the video so far and exits
+    renderer.submit(job, render)
+
+# Frame cache, opened on first use, or None if use_frame_cache is off
+def get_frame_cache():
+    global frame_cache
+    if not use_frame_cache:
+        return None
+    if frame_cache is None:
+        frame_cache = FrameCache(frame_cache_dir, frame_cache_bytes)
+    return frame_cache
+
+"""
+Hand the frames of a recording that are in the frame cache to output, keying each state on scene (a copy it poses).
+Returns the keys (None when not caching) and the indices of the frames that still need ray tracing.
+"""
+def write_cached_frames(scene, states, width, height, bs, output):
+    cache = get_frame_cache()
+    keys = [None] * len(states)
+    todo = []
+    for (index, state) in enumerate(states):
+        if cache is not None:
+            keys[index] = FrameCache.frame_key(scene, apply_record_state, state, width, height, bs)
+            pixels = cache.get(keys[index])
+            if pixels is not None:
+                output.write(pixels, index)
+                continue
+        todo.append(index)
+    if cache is not None:
+        print("{0} of {1} frames found in the frame cache".format(len(states) - len(todo), len(states)))
+    return (keys, todo)
+
+def cache_frame(key, pixels):
+    if key is not None:
+        get_frame_cache().put(key, pixels)
+
+"""
+Where a recording's frames go, in order: streamed into a video (record_video) and/or saved as images in
+the background (record_stills), each file added to the job's outputs once it is written.
+"""
+def new_recording_output(job, width, height):
+    global recording_count
+    stills = FrameWriter(frame_format, png_compression=frame_png_compression, written=job.outputs) if record_stills or not record_video else None
+    filename = None
+    if record_video:
+        filename = 'recording{0}.mp4'.format(recording_count)
+        recording_count += 1
+    return VideoWriter(filename, width, height, fps=FPS, stills=stills)
+
+# Finish the video and wait for the last stills to be written, failing the job if any could not be
+def close_recording_output(job, output):
+    output.close()
+    if output.filename is not None:
+        job.outputs.append(output.filename)
+    if output.stills is not None:
+        print("Recorded frames saved as 'frame*.{0}'".format(output.stills.image_format))
+        if output.stills.error is not None:
+            raise output.stills.error
+
+# Size ray traced images are rendered at, independent of the window
+def render_size():
+    return (render_width or win.width * render_scale, render_height or win.height * render_scale)
+
+# Off-screen window to ray trace into: images too big for memory go to a .npy file next to the image they are saved as
+def new_render_window(width, height, filename):
+    if width * height > RGBPixmap.MAX_IN_MEMORY_PIXELS:
+        return Window(width, height, pixmap=RGBPixmap(height, width, filename=os.path.splitext(filename)[0] + '.npy'))
+    return Window(width, height)
+
+"""
+The worker pools and coordinator below are only fetched by jobs on the background renderer, which runs one job
+at a time, so a pool being replaced is never in use. A new one starts from scene, the job's copy of the scene.
+"""
 
-    # Restore it back
-    restore_state(save_state)
+# Pool of worker processes writing tiles into a shared pixmap (a file for very large images), kept between single images of the same size
+def get_tile_pool(scene, width, height):
+    global tile_pool
+    if tile_pool is not None and not tile_pool.matches(width, height):
+        tile_pool.close()
+        tile_pool = None
+    if tile_pool is None:
+        scene.freeze()  # So the workers do not each redo it
+        filename = 'tiles.npy' if width * height > RGBPixmap.MAX_IN_MEMORY_PIXELS else None
+        tile_pool = TilePool(scene, apply_record_state, width, height, record_processes, filename=filename)
+    return tile_pool
+
+# Pool of worker processes rendering whole frames, reused as long as the render settings match
+def get_record_pool(scene, width, height, bs):
+    global record_pool
+    if record_pool is not None and not record_pool.matches(width, height, bs):
+        record_pool.close()
+        record_pool = None
+    if record_pool is None:
+        scene.freeze()
+        record_pool = RecordPool(scene, apply_record_state, width, height, bs, record_processes)
+    return record_pool
+
+# Coordinator for RenderWorkers connected over sockets, started with render_workers local ones (waiting up to 10s for them)
+def get_render_coordinator(scene):
+    global render_coordinator
+    if render_coordinator is None:
+        scene.freeze()
+        render_coordinator = RenderCoordinator(scene, apply_record_state, render_address)
+        RenderWorker.spawn_local(render_coordinator.address, render_coordinator.authkey, render_workers)
+        print("Render workers can join with: python RenderWorker.py {0} {1}".format(
+            ' '.join(str(part) for part in render_coordinator.address) if isinstance(render_coordinator.address, tuple) else render_coordinator.address,
+            render_coordinator.authkey.hex()))
+        render_coordinator.wait_for_workers(render_workers, timeout=10)
+    return render_coordinator
 
 def handle_events():
-    global render_mode, block_size, light_speed, animate, record
+    global render_mode, block_size, light_speed, animate, record, show_live_render, render_scale
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             return False
@@ -412,11 +676,19 @@ def handle_events():
                     record = []
                     render_mode = RENDER_RAY_RECORD
                 else:
-                    # End it and begin ray tracing each image
-                    raytrace_records(record)
-                    render_mode = RENDER_SOLID
+                    # End it and queue ray tracing each image
+                    queue_record_render(record)
                     animate = False
                     render_mode = RENDER_SOLID # So doesn't try to render it again!
+            elif event.key == pygame.K_c:
+                cancelled = renderer.cancel_all()
+                if cancelled > 0:
+                    print("Cancelled {0} ray tracing job(s)".format(cancelled))
+            elif event.key == pygame.K_r:
+                render_scale = render_scale * 2 if render_scale < 8 else 1
+                print("Ray traced images will be {0}x{1}".format(*render_size()))
+            elif event.key == pygame.K_v:
+                show_live_render = not show_live_render
             elif event.key == pygame.K_SPACE:
                 animate = not animate
             elif event.key == pygame.K_PERIOD:
@@ -426,9 +698,11 @@ def handle_events():
     return True
 
 def main():
-    global light_angle, light_distance, lightA, render_mode, animate
+    global light_angle, light_distance, lightA, render_mode, animate, renderer
     win.initialize()
+    renderer = BackgroundRenderer()
     init_scene()
+    scn.render_threads = render_threads
 
     clock = pygame.time.Clock()
     running = True
@@ -454,9 +728,17 @@ def main():
             set_looping_light_positions(lightA)
 
         display()
+        show_render_status()
         
         clock.tick(FPS)
 
+    renderer.stop()
+    if record_pool is not None:
+        record_pool.close()
+    if render_coordinator is not None:
+        render_coordinator.close()
+    if tile_pool is not None:
+        tile_pool.close()
     pygame.quit()
 
 if __name__ == "__main__":
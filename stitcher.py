@@ -1,70 +1,198 @@
-"""
-Author: ChatGPT 4o
-Modified by: Christian Duncan
-
-This code just stitches together the PNG files into an mp4 file for later playback.
-"""
-import argparse
-import glob
-from moviepy import ImageSequenceClip
-
-def create_mp4_from_pngs(png_files, output_file, fps, codec):
-    """
-    Create an MP4 video from a collection of PNG files.
-    
-    Args:
-        png_files (list): List of file paths to the PNG files in order.
-        output_file (str): Output file path for the MP4 video.
-        fps (int): Frames per second for the video.
-        codec (str): Codec to use for the video.
-    """
-    # Create a video clip from the image sequence
-    clip = ImageSequenceClip(png_files, fps=fps)
-    
-    # Write the clip to an MP4 file
-    clip.write_videofile(output_file, codec=codec, fps=fps)
-
-def main():
-    parser = argparse.ArgumentParser(description="Create an MP4 video from PNG files.")
-    parser.add_argument(
-        "files",
-        metavar="files",
-        nargs="+",
-        help="List of PNG files to include in the video, in the desired order."
-    )
-    parser.add_argument(
-        "-output",
-        type=str,
-        default="output_video.mp4",
-        help="Output MP4 file name (default: output_video.mp4)"
-    )
-    parser.add_argument(
-        "-fps",
-        type=int,
-        default=24,
-        help="Frames per second for the video (default: 24)"
-    )
-    parser.add_argument(
-        "-codec",
-        type=str,
-        default="libx264",
-        help="Video codec to use (default: libx264)"
-    )
-
-    args = parser.parse_args()
-
- # Expand wildcards using glob
-    expanded_files = []
-    for pattern in args.files:
-        expanded_files.extend(glob.glob(pattern))
-    
-    if not expanded_files:
-        print("No files matched the given patterns.")
-        return
-
-    # Call the video creation function
-    create_mp4_from_pngs(sorted(expanded_files), args.output, args.fps, args.codec)
-    print(f"Video saved as {args.output}")
-
-if __name__ == "__main__":
-    main()
+"""
+Author: ChatGPT 4o
+Modified by: Christian Duncan
+
+This code just stitches together the PNG files into an mp4 file for later playback.
+Frames are decoded by a pool of threads a few at a time and streamed into ffmpeg, so memory use stays
+the same however long the sequence is. The video is written in segments, so an interrupted run
+can be resumed with -resume, and the segments are joined (without re-encoding) at the end.
+"""
+import os
+import json
+import time
+import glob
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+import imageio_ffmpeg
+from VideoWriter import VideoWriter
+
+def decode_png(filename):
+    """
+    Decode one image into an array of RGB pixels (rows, cols, 3), timing it.
+
+    Returns:
+        tuple: (pixels, seconds spent decoding)
+    """
+    start = time.perf_counter()
+    with Image.open(filename) as image:
+        pixels = np.asarray(image.convert('RGB'))
+    return (pixels, time.perf_counter() - start)
+
+def segment_name(output_file, number):
+    return '{0}.part{1:04}.mp4'.format(os.path.splitext(output_file)[0], number)
+
+def create_mp4_from_pngs(png_files, output_file, fps, codec, threads=None, prefetch=None, segment_frames=600, resume=False):
+    """
+    Create an MP4 video from a collection of PNG files.
+
+    Args:
+        png_files (list): List of file paths to the PNG files in order.
+        output_file (str): Output file path for the MP4 video.
+        fps (int): Frames per second for the video.
+        codec (str): Codec to use for the video.
+        threads (int): Threads decoding frames (default: one per CPU core).
+        prefetch (int): Most frames decoded ahead of the encoder (default: twice the threads).
+        segment_frames (int): Frames per segment, the unit an interrupted run resumes from.
+        resume (bool): Keep the segments finished by an earlier run with the same files and settings.
+    """
+    threads = threads or os.cpu_count()
+    prefetch = prefetch or 2 * threads
+    progress_file = output_file + '.stitch.json'
+    settings = {'files': len(png_files), 'first': png_files[0], 'fps': fps, 'codec': codec, 'segment_frames': segment_frames}
+
+    # Segments finished by an earlier run, if it was stitching the same thing
+    segments = []
+    if resume and os.path.exists(progress_file):
+        with open(progress_file) as file:
+            progress = json.load(file)
+        if progress['settings'] == settings:
+            # Only the unbroken run of segments from the start counts, frames are resumed right after it
+            for segment in progress['segments']:
+                if segment != segment_name(output_file, len(segments)) or not os.path.exists(segment):
+                    break
+                segments.append(segment)
+            print(f"Resuming after {len(segments)} finished segment(s)")
+        else:
+            print("Earlier run was stitching something else, starting over")
+
+    def save_progress():
+        with open(progress_file, 'w') as file:
+            json.dump({'settings': settings, 'segments': segments}, file)
+
+    start_frame = len(segments) * segment_frames
+    decode_seconds = 0.0    # Summed over the threads
+    encode_seconds = 0.0    # Spent handing frames to ffmpeg (which blocks while it is behind) and waiting for it to finish each segment
+    waiting_seconds = 0.0   # Spent waiting for frames to be decoded
+    start = time.perf_counter()
+    last_report = start
+    writer = None
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = []        # Decodes in flight, oldest first, at most prefetch of them
+        next_file = start_frame
+        for index in range(start_frame, len(png_files)):
+            while next_file < len(png_files) and len(pending) < prefetch:
+                pending.append(pool.submit(decode_png, png_files[next_file]))
+                next_file += 1
+            wait_start = time.perf_counter()
+            (pixels, seconds) = pending.pop(0).result()
+            waiting_seconds += time.perf_counter() - wait_start
+            decode_seconds += seconds
+
+            if writer is None:
+                writer = VideoWriter(segment_name(output_file, len(segments)), pixels.shape[1], pixels.shape[0], fps=fps, codec=codec)
+            elif (pixels.shape[1], pixels.shape[0]) != (writer.width, writer.height):
+                raise ValueError(f"{png_files[index]} is {pixels.shape[1]}x{pixels.shape[0]}, earlier frames are {writer.width}x{writer.height}")
+            encode_start = time.perf_counter()
+            writer.write(pixels, index % segment_frames)
+            encode_seconds += time.perf_counter() - encode_start
+
+            if (index + 1) % segment_frames == 0 or index + 1 == len(png_files):
+                encode_start = time.perf_counter()
+                writer.close()  # ffmpeg encodes the frames still in its pipe before exiting
+                encode_seconds += time.perf_counter() - encode_start
+                segments.append(writer.filename)
+                save_progress()     # Only finished segments are recorded, so a resume never uses a cut off one
+                writer = None
+
+            now = time.perf_counter()
+            if now - last_report >= 5 or index + 1 == len(png_files):
+                last_report = now
+                done = index + 1 - start_frame
+                print(f"Frame {index + 1} of {len(png_files)}: {done / (now - start):.1f} frames/s overall, "
+                      f"decode {done / max(decode_seconds, 1e-9):.1f} frames/s per thread ({threads} threads), "
+                      f"encode {done / max(encode_seconds, 1e-9):.1f} frames/s, "
+                      f"{waiting_seconds / (now - start):.0%} of the time waiting for decodes")
+
+    # Join the segments without re-encoding them
+    list_file = output_file + '.segments.txt'
+    with open(list_file, 'w') as file:
+        for segment in segments:
+            file.write("file '{0}'\n".format(os.path.abspath(segment).replace("'", "'\\''")))
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                    '-i', list_file, '-c', 'copy', output_file], check=True)
+    for segment in segments:
+        os.remove(segment)
+    os.remove(list_file)
+    os.remove(progress_file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Create an MP4 video from PNG files.")
+    parser.add_argument(
+        "files",
+        metavar="files",
+        nargs="+",
+        help="List of PNG files to include in the video, in the desired order."
+    )
+    parser.add_argument(
+        "-output",
+        type=str,
+        default="output_video.mp4",
+        help="Output MP4 file name (default: output_video.mp4)"
+    )
+    parser.add_argument(
+        "-fps",
+        type=int,
+        default=24,
+        help="Frames per second for the video (default: 24)"
+    )
+    parser.add_argument(
+        "-codec",
+        type=str,
+        default="libx264",
+        help="Video codec to use (default: libx264)"
+    )
+    parser.add_argument(
+        "-threads",
+        type=int,
+        default=None,
+        help="Threads decoding frames (default: one per CPU core)"
+    )
+    parser.add_argument(
+        "-prefetch",
+        type=int,
+        default=None,
+        help="Most frames decoded ahead of the encoder (default: twice the threads)"
+    )
+    parser.add_argument(
+        "-segment",
+        type=int,
+        default=600,
+        help="Frames per segment, the unit an interrupted run resumes from (default: 600)"
+    )
+    parser.add_argument(
+        "-resume",
+        action="store_true",
+        help="Continue an interrupted run with the same files and settings"
+    )
+
+    args = parser.parse_args()
+
+ # Expand wildcards using glob
+    expanded_files = []
+    for pattern in args.files:
+        expanded_files.extend(glob.glob(pattern))
+
+    if not expanded_files:
+        print("No files matched the given patterns.")
+        return
+
+    # Call the video creation function
+    create_mp4_from_pngs(sorted(expanded_files), args.output, args.fps, args.codec,
+                         args.threads, args.prefetch, args.segment, args.resume)
+    print(f"Video saved as {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+from Color import Color
+from Light import Light
+from Scene import Scene
+from Camera import Camera
+from Point3 import Point3
+from Vector3 import Vector3
+from SphereObj import SphereObj
+from FrameCache import FrameCache
+
+def apply_state(scene, state):
+    scene.lights[0].set_position(state[1], 5, 5)
+
+def make_scene():
+    scene = Scene()
+    scene.add_object(SphereObj())
+    light = Light()
+    light.obj = SphereObj()
+    scene.add_light(light)
+    return scene
+
+def make_state(light_x=0):
+    return (Camera(Point3(0, 0, 10), Point3(0, 0, 0), Vector3(0, 1, 0)), light_x)
+
+def test_key_is_deterministic():
+    key = FrameCache.frame_key(make_scene(), apply_state, make_state(), 64, 48, 1)
+    assert FrameCache.frame_key(make_scene(), apply_state, make_state(), 64, 48, 1) == key
+
+def test_key_changes_with_state_and_settings():
+    key = FrameCache.frame_key(make_scene(), apply_state, make_state(), 64, 48, 1)
+    assert FrameCache.frame_key(make_scene(), apply_state, make_state(2), 64, 48, 1) != key
+    assert FrameCache.frame_key(make_scene(), apply_state, make_state(), 64, 48, 2) != key
+
+def test_key_changes_with_global_ambient():
+    original = Light.get_global_ambient()
+    scene = make_scene()
+    try:
+        key = FrameCache.frame_key(scene, apply_state, make_state(), 64, 48, 1)
+        Light.set_global_ambient(Color(0.1, 0.2, 0.3, 1.0))
+        assert FrameCache.frame_key(scene, apply_state, make_state(), 64, 48, 1) != key
+    finally:
+        Light.set_global_ambient(original)
+
+def test_get_put_and_eviction(tmp_path):
+    cache = FrameCache(str(tmp_path), max_bytes=2 * 64 * 48 * 3 + 512)
+    frames = [np.full((48, 64, 3), i, dtype=np.uint8) for i in range(3)]
+    assert cache.get('a') is None
+    for (when, key, frame) in zip(range(3), 'abc', frames):
+        cache.put(key, frame)
+        os.utime(cache.path(key), (1000 + when, 1000 + when))   # Distinct use times, however fast the puts are
+    assert cache.get('a') is None       # Least recently used, evicted
+    assert (cache.get('c') == frames[2]).all()
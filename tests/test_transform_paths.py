@@ -0,0 +1,49 @@
+import random
+import pytest
+from Hit import Hit
+from Ray import Ray
+from Point3 import Point3
+from Vector3 import Vector3
+from BoxObj import BoxObj
+from SphereObj import SphereObj
+from CylinderObj import CylinderObj
+import GeomObj
+
+# (expected transform kind, transform applied to a fresh object)
+TRANSFORMS = [
+    (GeomObj.TRANSFORM_IDENTITY, lambda obj: None),
+    (GeomObj.TRANSFORM_TRANSLATE, lambda obj: obj.translate(0.5, -1.0, 2.0)),
+    (GeomObj.TRANSFORM_SCALE, lambda obj: (obj.translate(0.5, -1.0, 2.0), obj.scale(2.0, 0.5, 1.5))),
+    (GeomObj.TRANSFORM_UNIFORM, lambda obj: (obj.translate(-1.0, 0.5, 0.0), obj.scale(1.5, 1.5, 1.5))),
+    (GeomObj.TRANSFORM_SCALE, lambda obj: (obj.translate(0.0, 1.0, -0.5), obj.scale(-1.5, -1.5, -1.5))),
+]
+
+def random_rays(center, count, rng):
+    # Rays from random points around the object aimed at random points near its center
+    for i in range(count):
+        source = Point3(*(c + rng.uniform(-8, 8) for c in center))
+        target = (c + rng.uniform(-1.5, 1.5) for c in center)
+        (tx, ty, tz) = target
+        yield Ray(source, Vector3(tx - source.x, ty - source.y, tz - source.z))
+
+@pytest.mark.parametrize('shape', [SphereObj, BoxObj, CylinderObj])
+@pytest.mark.parametrize('kind, transform', TRANSFORMS)
+def test_fast_paths_match_general(shape, kind, transform):
+    obj = shape()
+    transform(obj)
+    obj.freeze()
+    assert obj.transform_kind == kind
+    rng = random.Random(27)
+    hits = 0
+    for ray in random_rays(obj.world_center, 300, rng):
+        fast = Hit()
+        general = Hit()
+        obj.intersect(ray, fast)
+        obj.intersect_general(ray, general)
+        assert fast.t == pytest.approx(general.t, rel=1e-9, abs=1e-9)
+        if general.t != -1:
+            hits += 1
+            fast.norm.normalize()
+            general.norm.normalize()
+            assert (fast.norm.dx, fast.norm.dy, fast.norm.dz) == pytest.approx((general.norm.dx, general.norm.dy, general.norm.dz), abs=1e-7)
+    assert hits > 50    # The rays really exercise the hit path